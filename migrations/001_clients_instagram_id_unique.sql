@@ -0,0 +1,48 @@
+-- save_or_update_client_data upserts on instagram_id, which needs a unique index.
+-- Duplicate rows (from the old select-then-insert race) are merged into one row per
+-- instagram_id first, so the index can be built without losing what any of them held.
+
+-- Every duplicated row is copied here before the merge, so nothing is lost for good
+CREATE TABLE IF NOT EXISTS clients_duplicates_backup AS
+SELECT * FROM clients WHERE false;
+
+INSERT INTO clients_duplicates_backup
+SELECT * FROM clients
+WHERE instagram_id IN (SELECT instagram_id FROM clients GROUP BY instagram_id HAVING count(*) > 1);
+
+-- Merged values: the first non-null value of each field, and paid if any row was paid.
+-- Rows are only ordered by storage position, so conflicting values are listed in the backup.
+CREATE TEMP TABLE clients_merged AS
+SELECT instagram_id,
+       (array_agg(name ORDER BY ctid DESC) FILTER (WHERE name IS NOT NULL))[1] AS name,
+       (array_agg(email ORDER BY ctid DESC) FILTER (WHERE email IS NOT NULL))[1] AS email,
+       (array_agg(telegram_username ORDER BY ctid DESC) FILTER (WHERE telegram_username IS NOT NULL))[1] AS telegram_username,
+       (array_agg(phone_number ORDER BY ctid DESC) FILTER (WHERE phone_number IS NOT NULL))[1] AS phone_number,
+       (array_agg(city_country ORDER BY ctid DESC) FILTER (WHERE city_country IS NOT NULL))[1] AS city_country,
+       (array_agg(interests ORDER BY ctid DESC) FILTER (WHERE interests IS NOT NULL))[1] AS interests,
+       (array_agg(final_decision ORDER BY ctid DESC) FILTER (WHERE final_decision IS NOT NULL))[1] AS final_decision,
+       bool_or(paid) AS paid
+FROM clients
+GROUP BY instagram_id
+HAVING count(*) > 1;
+
+DELETE FROM clients a
+USING clients b
+WHERE a.instagram_id = b.instagram_id
+  AND a.ctid < b.ctid;
+
+UPDATE clients c
+SET name = m.name,
+    email = m.email,
+    telegram_username = m.telegram_username,
+    phone_number = m.phone_number,
+    city_country = m.city_country,
+    interests = m.interests,
+    final_decision = m.final_decision,
+    paid = m.paid
+FROM clients_merged m
+WHERE c.instagram_id = m.instagram_id;
+
+DROP TABLE clients_merged;
+
+CREATE UNIQUE INDEX IF NOT EXISTS clients_instagram_id_key ON clients (instagram_id);
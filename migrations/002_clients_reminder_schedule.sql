@@ -0,0 +1,16 @@
+-- The reminder scheduler keeps each client's next reminder in the clients row and
+-- only fetches rows whose next_reminder_at is due, through the partial index below.
+ALTER TABLE clients
+  ADD COLUMN IF NOT EXISTS last_message_at timestamptz,
+  ADD COLUMN IF NOT EXISTS next_reminder_at timestamptz,
+  ADD COLUMN IF NOT EXISTS reminder_stage integer NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS clients_next_reminder_at_idx
+  ON clients (next_reminder_at)
+  WHERE next_reminder_at IS NOT NULL;
+
+-- Clients the old 12-hour scan would have reminded get their first reminder on the next run
+UPDATE clients
+SET next_reminder_at = now()
+WHERE next_reminder_at IS NULL
+  AND (final_decision IN ('Uncertain', 'Leaning Towards Yes', 'Leaning Towards No') OR paid = false);
@@ -0,0 +1,2 @@
+-- Language of the client's messages (russian, kazakh or english), used to pick reminder variants
+ALTER TABLE clients ADD COLUMN IF NOT EXISTS language text;
@@ -1,12 +1,17 @@
 import aiohttp
+import asyncio
 import os
 import re
 from dotenv import load_dotenv
-from utils import detect_language, conversation_history
+from utils import detect_language, conversation_history, client_profiles, estimate_tokens
 import logging
 import json
 import random
-from database_handler import save_or_update_client_data
+from write_buffer import get_write_buffer
+from http_client import get_session, ANTHROPIC_TIMEOUT
+from prompt_registry import get_prompt_registry
+from extraction import extract_fields
+from database_handler import get_client_data
 
 logger = logging.getLogger(__name__)
 
@@ -17,138 +22,169 @@ ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 if not ANTHROPIC_API_KEY:
     logger.error("ANTHROPIC_API_KEY is not set in the environment variables")
 
-def get_missing_info(user_data):
-    required_fields = ['name', 'email', 'telegram_username', 'phone_number', 'city_country', 'interests', 'final_decision', 'paid']
-    return [field for field in required_fields if field not in user_data]
+ANTHROPIC_URL = "https://api.anthropic.com/v1/messages"
+ANTHROPIC_HEADERS = {
+    "x-api-key": ANTHROPIC_API_KEY,
+    "anthropic-version": "2023-06-01",
+    "anthropic-beta": "prompt-caching-2024-07-31",
+    "content-type": "application/json"
+}
 
-def generate_info_summary(user_data):
-    summary = "Here's a summary of the information I have:\n"
-    if 'name' in user_data:
-        summary += f"Name: {user_data['name']}\n"
-    if 'email' in user_data:
-        summary += f"Email: {user_data['email']}\n"
-    if 'telegram_username' in user_data:
-        summary += f"Telegram: {user_data['telegram_username']}\n"
-    if 'phone_number' in user_data:
-        summary += f"Phone: {user_data['phone_number']}\n"
-    if 'city_country' in user_data:
-        summary += f"Location: {user_data['city_country']}\n"
-    if 'interests' in user_data:
-        summary += f"Interests: {user_data['interests']}\n"
-    if 'final_decision' in user_data:
-        summary += f"Course Decision: {user_data['final_decision']}\n"
-    if 'paid' in user_data:
-        summary += f"Payment Status: {'Paid' if user_data['paid'] else 'Not Paid'}\n"
-    return summary
+CLAUDE_MODEL = "claude-3-5-sonnet-20240620"
 
-async def generate_ai_response(user_id, input_text, context=None):
-    language = detect_language(input_text)
-    
-    url = "https://api.anthropic.com/v1/messages"
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
-    
-    if context is None:
-        try:
-            with open('prompts/instagram_consultant_prompt.txt', 'r') as file:
-                base_context = file.read()
-        except FileNotFoundError:
-            base_context = "You are an AI assistant named Dias for an Instagram consultant service."
-        
-        context = f"""{base_context}
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "claude-3-haiku-20240307")
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 300))
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between an Instagram consultant and a client. "
+    "Update the summary with the new messages. Keep facts the client shared, their questions, concerns "
+    "and decisions, and what the consultant promised. Reply with the updated summary only, in at most "
+    "a few short paragraphs."
+)
 
-You are an AI assistant representing a company that offers two primary services:
+STREAM_FIRST_CHUNK_MIN = int(os.getenv("STREAM_FIRST_CHUNK_MIN", 40))  # characters before the first sentence cut
+STREAM_CHUNK_MAX = int(os.getenv("STREAM_CHUNK_MAX", 900))  # force a cut before a chunk gets this long
 
-**Educational Course**: An AI Integration Programming Course that teaches clients how to integrate AI into messengers, CRM systems, and websites without needing a programming background.
+EMOJIS = ['👋', '😊', '💡', '🚀', '🌟', '🔥', '💪', '📈']
+FALLBACK_RESPONSE = "I apologize, but I'm experiencing some technical difficulties. Could you please try asking your question again? I'm here to help with any inquiries about our Instagram consultant service. 😊"
 
-**Outsourced AI Bot Development**: Custom development of AI bots tailored to clients' specific needs for messengers, CRM systems, and websites.
+SENTENCE_END = re.compile(r'[.!?…](?:["\')\]]*)\s+')
+# A period after a number or a short token is a list marker or an abbreviation ("1.", "e.g.", "Dr.")
+ABBREVIATION = re.compile(r'\d+|(?:[^\W\d_]{1,3}\.)*[^\W\d_]{1,3}')
 
-**Your Role and Responsibilities:**
+DECISION_HINTS = {
+    'Uncertain': "\nThe user is uncertain about using our service. Address their specific concerns, provide more detailed information about our services, and highlight the unique benefits we offer. Ask open-ended questions to understand their hesitations better.",
+    'Leaning Towards Yes': "\nThe user is leaning towards using our service. Reinforce their positive inclination by summarizing the key benefits and addressing any remaining doubts they might have. Offer to guide them through the next steps.",
+    'Leaning Towards No': "\nThe user is leaning towards not using our service. Try to understand their reasons without being pushy. Offer additional information or alternatives that might better suit their needs. Keep the conversation open for future possibilities.",
+    'Not Interested': "\nThe user has indicated they're not interested in our service. Respectfully acknowledge their decision, thank them for their time, and keep the door open for future engagement. You might offer to keep them updated on new services or promotions if they're interested."
+}
 
-- **Warmly Engage Clients**: Initiate conversations with a friendly and enthusiastic tone, building rapport and making clients feel welcome.
-- **Determine Client Interest**: Identify whether the client is interested in the educational course or the AI bot development service.
-- **Information Gathering**: Collect essential personal and service-specific details in a natural, step-by-step manner without overwhelming the client.
-- **Highlight Benefits**: Present the features and emotional value of the services, showing how they meet the client's needs and aspirations.
-- **Address Concerns**: Empathetically handle any questions or objections, providing clear and supportive responses without pressuring the client.
-- **Guide Towards Action**: Encourage clients to take the next steps, whether enrolling in the course or proceeding with a project proposal, while respecting their timeline.
-- **Follow-Up**: If the client isn't ready to commit immediately, send friendly reminders and remain available for further assistance.
-- **Maintain Professionalism**: Use courteous and respectful language, ensure confidentiality, and avoid technical jargon unless appropriate.
-- **Accurate Data Recording**: Keep precise records of all client interactions, including their final decision and payment status, in compliance with data protection regulations.
+PAYMENT_HINTS = {
+    True: "\nThe user has paid for the service. Express gratitude for their payment and commitment. Offer immediate next steps or information on how to get started with the service.",
+    False: "\nThe user hasn't paid for the service yet. If they've decided to join, gently remind them about the payment process, offer assistance if needed, and provide clear instructions on how to complete the payment."
+}
 
-**Communication Best Practices:**
+REQUIRED_FIELDS = ['name', 'email', 'telegram_username', 'phone_number', 'city_country', 'interests', 'final_decision', 'paid']
+PROFILE_FIELDS = REQUIRED_FIELDS + ['language']
 
-- **Ask One Question at a Time**: To avoid overwhelming the client, ensure each question is clear and allows them to provide the needed information before proceeding.
-- **Use Open-Ended Questions**: Encourage dialogue and detailed responses to better understand the client's needs.
-- **Provide Clear Information**: Offer straightforward explanations about services, pricing, and payment options based on the client's location.
-- **Show Genuine Interest**: Demonstrate enthusiasm for helping the client achieve their AI goals, making the conversation personalized and engaging.
+def get_missing_info(profile):
+    return [field for field in REQUIRED_FIELDS if field not in profile]
 
-**Final Goal:**
+def generate_info_summary(profile):
+    if profile.summary is not None:
+        return profile.summary
+    summary = "Here's a summary of the information I have:\n"
+    if 'name' in profile:
+        summary += f"Name: {profile.get('name')}\n"
+    if 'email' in profile:
+        summary += f"Email: {profile.get('email')}\n"
+    if 'telegram_username' in profile:
+        summary += f"Telegram: {profile.get('telegram_username')}\n"
+    if 'phone_number' in profile:
+        summary += f"Phone: {profile.get('phone_number')}\n"
+    if 'city_country' in profile:
+        summary += f"Location: {profile.get('city_country')}\n"
+    if 'interests' in profile:
+        summary += f"Interests: {profile.get('interests')}\n"
+    if 'final_decision' in profile:
+        summary += f"Course Decision: {profile.get('final_decision')}\n"
+    if 'paid' in profile:
+        summary += f"Payment Status: {'Paid' if profile.get('paid') else 'Not Paid'}\n"
+    profile.summary = summary
+    return summary
+
+def build_system_blocks(static_context, dynamic_context):
+    """
+    Build the system prompt as a cacheable static prefix plus a small per-turn suffix.
+
+    :param static_context: Large prompt text that is identical across calls
+    :param dynamic_context: Per-user hints (missing info, decision, payment)
+    :return: List of system content blocks for the Messages API
+    """
+    blocks = [{"type": "text", "text": static_context, "cache_control": {"type": "ephemeral"}}]
+    if dynamic_context:
+        blocks.append({"type": "text", "text": dynamic_context})
+    return blocks
+
+def log_token_usage(user_id, usage):
+    logger.info(
+        f"Anthropic usage for user {user_id}: input={usage.get('input_tokens', 0)}, "
+        f"cache_read={usage.get('cache_read_input_tokens', 0)}, "
+        f"cache_creation={usage.get('cache_creation_input_tokens', 0)}, "
+        f"output={usage.get('output_tokens', 0)}"
+    )
 
-Your ultimate aim is to provide exceptional service by thoroughly understanding each client's needs and offering solutions that help them integrate AI into their business or personal projects, either through education or custom development.
-"""
+async def generate_ai_response(user_id, input_text, context=None, on_chunk=None):
+    """
+    Generate a reply with Claude and record the turn in the conversation history.
 
-    history = conversation_history.get_history(user_id)
+    :param on_chunk: Optional async callback; when given the response is streamed and
+                     each finished chunk is passed to it as soon as it is complete. It
+                     returns False when a chunk could not be delivered
+    :return: The full response text
+    """
+    language = detect_language(input_text, user_id)
+    
+    if context is None:
+        context = get_prompt_registry().get_static_context()
+
+    # Older turns that don't fit the budget come back as a rolling summary
+    summary, history = await conversation_history.get_context(user_id, reserved_tokens=estimate_tokens(input_text))
     messages = [{"role": msg["role"], "content": msg["content"]} for msg in history]
     
-    # Get user data from conversation history
-    user_data = {}
-    for msg in history:
-        if msg["role"] == "user":
-            user_data.update(extract_client_info(msg["content"]))
+    # Client info is kept up to date by record_client_message, nothing to re-extract here
+    profile = await client_profiles.get_profile(user_id)
     
-    missing_info = get_missing_info(user_data)
+    # Per-user hints go after the cached prefix so they don't invalidate it
+    missing_info = get_missing_info(profile)
     if missing_info:
-        context += f"\n\nThe following information is still missing: {', '.join(missing_info)}. Focus on obtaining this information naturally in the conversation."
+        dynamic_context = f"The following information is still missing: {', '.join(missing_info)}. Focus on obtaining this information naturally in the conversation."
     else:
-        info_summary = generate_info_summary(user_data)
-        context += f"\n\nAll required information has been collected. Here's a summary:\n{info_summary}\nAsk the user if this information is correct and if they have any questions about our Instagram consultant service."
-
-    if 'final_decision' in user_data:
-        if user_data['final_decision'] == 'Uncertain':
-            context += "\nThe user is uncertain about using our service. Address their specific concerns, provide more detailed information about our services, and highlight the unique benefits we offer. Ask open-ended questions to understand their hesitations better."
-        elif user_data['final_decision'] == 'Leaning Towards Yes':
-            context += "\nThe user is leaning towards using our service. Reinforce their positive inclination by summarizing the key benefits and addressing any remaining doubts they might have. Offer to guide them through the next steps."
-        elif user_data['final_decision'] == 'Leaning Towards No':
-            context += "\nThe user is leaning towards not using our service. Try to understand their reasons without being pushy. Offer additional information or alternatives that might better suit their needs. Keep the conversation open for future possibilities."
-        elif user_data['final_decision'] == 'Not Interested':
-            context += "\nThe user has indicated they're not interested in our service. Respectfully acknowledge their decision, thank them for their time, and keep the door open for future engagement. You might offer to keep them updated on new services or promotions if they're interested."
-
-    if 'paid' in user_data:
-        if user_data['paid']:
-            context += "\nThe user has paid for the service. Express gratitude for their payment and commitment. Offer immediate next steps or information on how to get started with the service."
-        else:
-            context += "\nThe user hasn't paid for the service yet. If they've decided to join, gently remind them about the payment process, offer assistance if needed, and provide clear instructions on how to complete the payment."
+        info_summary = generate_info_summary(profile)
+        dynamic_context = f"All required information has been collected. Here's a summary:\n{info_summary}\nAsk the user if this information is correct and if they have any questions about our Instagram consultant service."
+
+    decision_hint = DECISION_HINTS.get(profile.get('final_decision'))
+    if decision_hint:
+        dynamic_context += decision_hint
+
+    if 'paid' in profile:
+        dynamic_context += PAYMENT_HINTS[bool(profile.get('paid'))]
+
+    if summary:
+        dynamic_context += f"\n\nSummary of the earlier conversation with this user:\n{summary}"
 
     messages.append({"role": "user", "content": input_text})
     
     data = {
-        "model": "claude-3-5-sonnet-20240620",
+        "model": CLAUDE_MODEL,
         "max_tokens": 1000,
-        "system": context,
+        "system": build_system_blocks(context, dynamic_context),
         "messages": messages
     }
     
+    delivered = []
+
+    async def deliver(chunk):
+        if await on_chunk(chunk) is False:
+            return False
+        delivered.append(chunk)
+        return True
+
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data, timeout=30) as response:
+        session = get_session()
+        if on_chunk is None:
+            async with session.post(ANTHROPIC_URL, headers=ANTHROPIC_HEADERS, json=data, timeout=ANTHROPIC_TIMEOUT) as response:
                 response.raise_for_status()
                 result = await response.json()
                 ai_response = result['content'][0]['text']
+            log_token_usage(user_id, result.get('usage', {}))
+            
+            if not any(emoji in ai_response for emoji in EMOJIS):
+                ai_response += f" {random.choice(EMOJIS)}"
+        else:
+            data["stream"] = True
+            ai_response = await stream_ai_response(session, ANTHROPIC_URL, ANTHROPIC_HEADERS, data, user_id, deliver)
         
-        emojis = ['👋', '😊', '💡', '🚀', '🌟', '🔥', '💪', '📈']
-        if not any(emoji in ai_response for emoji in emojis):
-            ai_response += f" {random.choice(emojis)}"
-        
-        conversation_history.add_message(user_id, "user", input_text)
-        conversation_history.add_message(user_id, "assistant", ai_response)
-        
-        # Extract and save client info after each message
-        new_info = extract_client_info(input_text)
-        if new_info:
-            await update_client_info(user_id, new_info)
+        await conversation_history.add_messages(user_id, [("user", input_text), ("assistant", ai_response)])
         
         return ai_response
     except aiohttp.ClientError as e:
@@ -159,66 +195,220 @@ Your ultimate aim is to provide exceptional service by thoroughly understanding
         logger.error(f"Unexpected response structure from Anthropic API: {e}")
     except Exception as e:
         logger.error(f"Unexpected error generating AI response: {e}")
-    
-    return "I apologize, but I'm experiencing some technical difficulties. Could you please try asking your question again? I'm here to help with any inquiries about our Instagram consultant service. 😊"
 
-def extract_client_info(message):
-    info = {}
-    message_lower = message.lower()
-    
-    # Name (don't overwrite existing name)
-    name_match = re.search(r'(?:my name is|i\'m|i am|call me)\s+([A-Za-z\s]+)', message_lower)
-    if name_match and 'name' not in info:
-        info['name'] = name_match.group(1).strip().title()
-    
-    # Email
-    email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', message)
-    if email_match:
-        info['email'] = email_match.group()
-    
-    # Telegram username
-    telegram_match = re.search(r'@(\w+)', message)
-    if telegram_match:
-        info['telegram_username'] = telegram_match.group()
-    
-    # Phone number (including country code)
-    phone_match = re.search(r'\+?\d{1,4}[-.\s]?\(?\d{1,4}\)?[-.\s]?\d{1,9}[-.\s]?\d{1,9}', message)
-    if phone_match:
-        info['phone_number'] = phone_match.group()
-    
-    # Location
-    location_match = re.search(r'(?:i\'m from|i am from|i live in|my location is)\s+([A-Za-z\s,]+)', message_lower)
-    if location_match:
-        info['city_country'] = location_match.group(1).strip().title()
-    
-    # Interests
-    interests_match = re.search(r'(?:interested in|passion for|excited about)\s+(.+?)(?:\.|$)', message_lower)
-    if interests_match:
-        info['interests'] = interests_match.group(1).strip()
-    
-    # Decision to join (expanded with more variations)
-    if re.search(r'\b(definitely join|absolutely|sign me up|ready to start|let\'s do this)\b', message_lower):
-        info['final_decision'] = "Joined"
-    elif re.search(r'\b(considering|leaning towards yes|probably will|sounds good|interested)\b', message_lower):
-        info['final_decision'] = "Leaning Towards Yes"
-    elif re.search(r'\b(not sure|maybe|thinking about it|need more time|uncertain|on the fence)\b', message_lower):
-        info['final_decision'] = "Uncertain"
-    elif re.search(r'\b(probably not|leaning towards no|not convinced|hesitant)\b', message_lower):
-        info['final_decision'] = "Leaning Towards No"
-    elif re.search(r'\b(not interested|don\'t want|no thanks|not for me)\b', message_lower):
-        info['final_decision'] = "Not Interested"
-    
-    # Payment status
-    if re.search(r'\b(paid|completed payment|payment sent|transaction done)\b', message_lower):
-        info['paid'] = True
-    elif re.search(r'\b(haven\'t paid|not paid|pending payment|still need to pay)\b', message_lower):
-        info['paid'] = False
-    
-    return info
+    if delivered:
+        # Part of the answer reached the user, the next turn has to know about it
+        await conversation_history.add_messages(user_id, [("user", input_text), ("assistant", "\n\n".join(delivered))])
+    # Don't apologise in the middle of a partly delivered answer
+    if on_chunk is not None and not delivered:
+        await on_chunk(FALLBACK_RESPONSE)
+    return FALLBACK_RESPONSE
 
-async def update_client_info(user_id, new_info):
+def build_system_request(prompt, instructions, model=CLAUDE_MODEL, max_tokens=1000, use_static_context=True):
+    """
+    Build a Messages API request for a one-off, history-free generation.
+
+    :param prompt: The single user turn
+    :param instructions: Task instructions, placed after the cached service context
+    :param use_static_context: Whether to start the system prompt with the cached service context
+    """
+    if use_static_context:
+        system = build_system_blocks(get_prompt_registry().get_static_context(), instructions)
+    else:
+        system = [{"type": "text", "text": instructions}]
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": system,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+
+async def generate_system_message(prompt, instructions, model=CLAUDE_MODEL, max_tokens=1000, use_static_context=True):
+    """
+    Generate text for a system-initiated message (reminders, summaries).
+
+    Uses the shared HTTP session and the same cached service context as live replies,
+    but never reads or writes conversation history, client profiles or the database.
+
+    :return: The generated text, or None if the request failed
+    """
+    data = build_system_request(prompt, instructions, model, max_tokens, use_static_context)
     try:
-        await save_or_update_client_data(user_id, new_info)
-        logger.info(f"Updated client info for user {user_id}: {new_info}")
+        async with get_session().post(ANTHROPIC_URL, headers=ANTHROPIC_HEADERS, json=data, timeout=ANTHROPIC_TIMEOUT) as response:
+            response.raise_for_status()
+            result = await response.json()
+        log_token_usage("system", result.get('usage', {}))
+        return result['content'][0]['text'].strip()
     except Exception as e:
-        logger.error(f"Error updating client info for user {user_id}: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error generating system message: {e}")
+        return None
+
+async def summarize_conversation(previous_summary, messages):
+    """
+    Fold messages that slid out of the context window into the rolling summary.
+
+    :param previous_summary: Current summary, empty for the first fold
+    :param messages: Messages to fold in, oldest first
+    :return: The updated summary, or None if the request failed
+    """
+    transcript = "\n".join(
+        f"{'Client' if msg['role'] == 'user' else 'Consultant'}: {msg['content']}" for msg in messages
+    )
+    content = f"Current summary:\n{previous_summary or '(none yet)'}\n\nNew messages:\n{transcript}"
+    return await generate_system_message(content, SUMMARY_PROMPT, SUMMARY_MODEL, SUMMARY_MAX_TOKENS, use_static_context=False)
+
+conversation_history.set_summarizer(summarize_conversation)
+
+async def load_client_profile(user_id):
+    """
+    Read a client's stored profile fields through the client cache.
+    """
+    row = await get_client_data(user_id) or {}
+    # Updates still waiting in the write buffer are newer than the row
+    row.update(get_write_buffer().get_pending(user_id) or {})
+    return {field: row[field] for field in PROFILE_FIELDS if row.get(field) is not None}
+
+client_profiles.set_loader(load_client_profile)
+
+def sentence_ends(text, end=None):
+    """
+    Offsets right after the sentence ends (and the whitespace following them) in text[:end].
+    """
+    ends = []
+    for match in SENTENCE_END.finditer(text, 0, len(text) if end is None else end):
+        index = match.start()
+        if text[index] == ".":
+            words = text[max(0, index - 16):index].split()
+            if words and ABBREVIATION.fullmatch(words[-1]):
+                continue
+        ends.append(match.end())
+    return ends
+
+def split_stream_buffer(buffer, first_chunk_sent):
+    """
+    Find the part of a streamed buffer that can be sent as a message right away.
+
+    The first chunk is cut at the last line break, or else the last sentence end, once
+    it is long enough; later chunks at paragraph breaks. Anything approaching
+    STREAM_CHUNK_MAX is cut at the last sentence end or space.
+
+    :return: Tuple of (ready text, remaining buffer)
+    """
+    cut = buffer.rfind("\n\n")
+    if cut > 0:
+        cut += 2
+    elif not first_chunk_sent and len(buffer) >= STREAM_FIRST_CHUNK_MIN:
+        # A line break keeps list items whole, which a sentence end can't promise
+        cut = buffer.rfind("\n") + 1
+        if cut <= 0:
+            ends = sentence_ends(buffer)
+            cut = ends[-1] if ends else -1
+    if cut <= 0 and len(buffer) >= STREAM_CHUNK_MAX:
+        ends = sentence_ends(buffer, STREAM_CHUNK_MAX)
+        cut = ends[-1] if ends else buffer.rfind(" ", 0, STREAM_CHUNK_MAX) + 1
+        if cut <= 0:
+            cut = STREAM_CHUNK_MAX
+    if cut <= 0:
+        return "", buffer
+    return buffer[:cut].strip(), buffer[cut:]
+
+async def stream_ai_response(session, url, headers, data, user_id, on_chunk):
+    """
+    Read a Messages API SSE stream and hand finished chunks to on_chunk while the rest is generated.
+
+    Chunks go through a queue to a sender task, so slow or throttled sends never hold
+    up reading the stream or count against its timeout. Chunks that were ready when
+    the stream fails are still sent.
+
+    :return: Full response text
+    """
+    parts = []
+    buffer = ""
+    chunk_count = 0
+    usage = {}
+    chunks = asyncio.Queue()
+    sender = asyncio.create_task(send_stream_chunks(chunks, on_chunk, user_id))
+    try:
+        async with session.post(url, headers=headers, json=data, timeout=ANTHROPIC_TIMEOUT) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if not line.startswith(b"data:"):
+                    continue
+                event = json.loads(line[5:])
+                event_type = event.get("type")
+                if event_type == "content_block_delta":
+                    text = event["delta"].get("text", "")
+                    parts.append(text)
+                    buffer += text
+                    ready, buffer = split_stream_buffer(buffer, chunk_count > 0)
+                    if ready:
+                        chunks.put_nowait(ready)
+                        chunk_count += 1
+                elif event_type == "message_start":
+                    usage.update(event["message"].get("usage", {}))
+                elif event_type == "message_delta":
+                    usage.update(event.get("usage", {}))
+                elif event_type == "error":
+                    raise aiohttp.ClientError(f"Stream error: {event.get('error')}")
+        log_token_usage(user_id, usage)
+
+        ai_response = "".join(parts)
+        tail = buffer.strip()
+        if tail and not any(emoji in ai_response for emoji in EMOJIS):
+            emoji = f" {random.choice(EMOJIS)}"
+            tail += emoji
+            ai_response += emoji
+        if tail:
+            chunks.put_nowait(tail)
+            chunk_count += 1
+    finally:
+        chunks.put_nowait(None)
+        delivered_all = await sender
+    if not delivered_all:
+        raise RuntimeError(f"Could not deliver every chunk of the response to user {user_id}")
+    logger.info(f"Streamed response to user {user_id} in {chunk_count} chunks")
+    return ai_response
+
+async def send_stream_chunks(chunks, on_chunk, user_id):
+    """
+    Pass queued chunks to on_chunk in order until None is queued. After a failed
+    chunk the rest are dropped, so the user never gets a reply with a gap in it.
+
+    :return: True if every chunk was delivered
+    """
+    delivered_all = True
+    while True:
+        chunk = await chunks.get()
+        if chunk is None:
+            return delivered_all
+        if not delivered_all:
+            continue
+        try:
+            delivered_all = await on_chunk(chunk) is not False
+        except Exception as e:
+            logger.error(f"Error sending a streamed chunk to user {user_id}: {e}")
+            delivered_all = False
+
+def extract_client_info(message):
+    return {field: match.value for field, match in extract_fields(message).items()}
+
+async def record_client_message(user_id, message):
+    """
+    Extract client info from a new user message, merge it into the profile and save what changed.
+
+    Call this exactly once per incoming message.
+
+    :return: Dictionary of the fields that changed
+    """
+    fields = extract_client_info(message)
+    # Stored so system-initiated messages, like reminders, can be written in the client's language
+    fields['language'] = detect_language(message, user_id)
+    changed = (await client_profiles.get_profile(user_id)).update(fields)
+    if changed:
+        await update_client_info(user_id, changed)
+    return changed
+
+async def update_client_info(user_id, new_info):
+    # Buffered; written to the database by the write-behind flush
+    get_write_buffer().add(user_id, new_info)
+    logger.info(f"Updated client info for user {user_id}: {new_info}")
@@ -0,0 +1,215 @@
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from extraction import extract_fields
+from utils import detect_language
+from message_splitter import split_message, joins_previous, is_regional_indicator, MESSAGE_MAX_BYTES
+from ai_handler import split_stream_buffer, ABBREVIATION
+
+# Realistic DMs in the languages we get (English, Russian, Kazakh), mixing
+# messages with and without client details
+DM_CORPUS = [
+    "Hi, I'm interested in your programming course.",
+    "You can call me John Doe.",
+    "I'm living in New York City, USA.",
+    "My email is john.doe@example.com and you can find me on Telegram @johndoe.",
+    "You can reach me at +1 (234) 567-8900 if needed.",
+    "I have a passion for AI and machine learning. Can you tell me more about the course?",
+    "That sounds great! I'd like to sign up for the course. What's the next step?",
+    "Awesome, I've completed the payment for the course.",
+    "Is there anything else you need from me?",
+    "How much does it cost?",
+    "Not sure yet, I need more time to think about it",
+    "Hello! Do you also build bots for WhatsApp and amoCRM?",
+    "I am from Almaty, Kazakhstan",
+    "sorry I haven't paid yet, still need to pay next week",
+    "no thanks, not for me",
+    "👋🔥",
+    "ok",
+    "Здравствуйте! Сколько стоит курс по интеграции ИИ?",
+    "Меня зовут Алия, я из Астаны. Интересует разработка бота для Instagram.",
+    "Мой номер +7 701 234 5678, telegram @aliya_kz",
+    "Я пока думаю, может быть в следующем месяце",
+    "Оплатила, проверьте пожалуйста",
+    "Сәлеметсіз бе! Курс туралы толығырақ айтып беріңізші",
+    "Менің атым Ерлан, Шымкенттен жазып отырмын",
+    "Бағасы қанша? Бөліп төлеуге бола ма?",
+    "Рахмет, ойланып көрейін",
+    "Привет, а можно оплатить картой Kaspi? Я готов начать прямо сейчас, my email is erlan.k@mail.kz",
+]
+
+def run_extraction_benchmark(rounds):
+    messages = DM_CORPUS * rounds
+    start = time.perf_counter()
+    matched_fields = 0
+    for message in messages:
+        matched_fields += len(extract_fields(message))
+    elapsed = time.perf_counter() - start
+    print(f"extract_fields: {len(messages)} messages in {elapsed:.3f}s "
+          f"({len(messages) / elapsed:,.0f} messages/sec, {matched_fields} fields)")
+
+def run_language_benchmark(rounds):
+    import langdetect
+    langdetect.DetectorFactory.seed = 0
+    # The full model is orders of magnitude slower, a fraction of the rounds is enough
+    model_messages = DM_CORPUS * max(1, rounds // 50)
+    start = time.perf_counter()
+    for message in model_messages:
+        try:
+            langdetect.detect(message)
+        except langdetect.LangDetectException:
+            pass
+    model_elapsed = time.perf_counter() - start
+    print(f"langdetect.detect: {len(model_messages)} messages in {model_elapsed:.3f}s "
+          f"({model_elapsed / len(model_messages) * 1e6:,.1f} us/message)")
+
+    messages = DM_CORPUS * rounds
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        detect_language(message, f"user-{i % 500}")
+    elapsed = time.perf_counter() - start
+    print(f"detect_language: {len(messages)} messages in {elapsed:.3f}s "
+          f"({elapsed / len(messages) * 1e6:,.1f} us/message, "
+          f"{model_elapsed / len(model_messages) / (elapsed / len(messages)):,.0f}x faster)")
+
+# Pieces long replies are made of: paragraphs, lists, emoji sequences that must
+# stay whole (ZWJ families, skin tones, flags, keycaps) and combining accents
+REPLY_PIECES = DM_CORPUS + [
+    "\n\n", "\n- ", "\n1. ", "👨‍👩‍👧‍👦", "👍🏽", "🇰🇿", "🏴󠁧󠁢󠁳󠁣󠁴󠁿", "1️⃣", "❤️", "é", "Ащщщщщщщщщщщщщщщщщщщщщщщщщщщщщщщщщщщ",
+    "https://example.com/a/very/long/link/" + "x" * 300,
+]
+
+def generate_replies(count, seed=42):
+    rng = random.Random(seed)
+    replies = []
+    for _ in range(count):
+        pieces = [rng.choice(REPLY_PIECES) for _ in range(rng.randint(1, 150))]
+        if rng.random() < 0.05:
+            # A "word" longer than a whole message, made of emoji only
+            pieces.append("👨‍👩‍👧‍👦" * rng.randint(40, 120))
+        replies.append(" ".join(pieces))
+    return replies
+
+def legacy_split_message(message, chunk_size=1000):
+    return [message[i:i+chunk_size] for i in range(0, len(message), chunk_size)]
+
+def check_split(message, chunks, max_bytes=MESSAGE_MAX_BYTES):
+    """
+    Properties every split must have; returns a list of violations.
+    """
+    problems = []
+    if any(len(chunk.encode("utf-8")) > max_bytes for chunk in chunks):
+        problems.append("chunk over the byte limit")
+    if re.sub(r"\s+", "", "".join(chunks)) != re.sub(r"\s+", "", message):
+        problems.append("text lost or changed")
+    for previous, chunk in zip(chunks, chunks[1:]):
+        if not chunk or joins_previous(chunk[0]) or previous.endswith("\u200d"):
+            problems.append("grapheme cluster split")
+        elif is_regional_indicator(chunk[0]) and is_regional_indicator(previous[-1]):
+            # A cut between two indicators is only valid after an even number of them
+            run = len(previous) - len(previous.rstrip("".join(map(chr, range(0x1F1E6, 0x1F200)))))
+            if run % 2:
+                problems.append("flag split")
+    return problems
+
+def run_split_benchmark(rounds):
+    replies = generate_replies(max(1, rounds // 10))
+    # No split can use fewer chunks than this
+    lower_bound = sum(-(-len(reply.strip().encode("utf-8")) // MESSAGE_MAX_BYTES) for reply in replies)
+    print(f"{len(replies)} replies need at least {lower_bound} chunks of {MESSAGE_MAX_BYTES} bytes")
+    for name, splitter in (("legacy split_message", legacy_split_message), ("split_message", split_message)):
+        start = time.perf_counter()
+        splits = [splitter(reply) for reply in replies]
+        elapsed = time.perf_counter() - start
+        chunk_count = sum(len(chunks) for chunks in splits)
+        violations = sum(bool(check_split(reply, chunks)) for reply, chunks in zip(replies, splits))
+        print(f"{name}: {len(replies)} replies in {elapsed:.3f}s "
+              f"({elapsed / len(replies) * 1e6:,.1f} us/reply), {chunk_count} chunks, "
+              f"{violations} replies violating the limit or splitting text")
+
+# Streamed replies with list numbers and abbreviations, which must not end a chunk
+STREAMED_REPLIES = [
+    "We offer:\n1. An AI course\n2. Custom bot development for Instagram and WhatsApp\n3. Consulting\n\nWhich one interests you?",
+    "Many clients asked about e.g. pricing, so here it is. The course costs 100 USD and starts in May. Want to join?",
+    "Great question! Dr. Aliya leads the course, i.e. you learn from a practitioner.\n\nShall I send the program?",
+    "Здравствуйте! Курс стоит 50 000 тг. Начало 1 июня, т.е. через две недели.\n\nЗаписать вас?",
+    "Сәлеметсіз бе! Бағасы 50 000 тг.\n1. Онлайн сабақтар\n2. Жеке кеңес\n\nҚайсысы қызық?",
+]
+
+def stream_chunks(reply, step):
+    chunks = []
+    buffer = ""
+    for start in range(0, len(reply), step):
+        buffer += reply[start:start + step]
+        ready, buffer = split_stream_buffer(buffer, bool(chunks))
+        if ready:
+            chunks.append(ready)
+    if buffer.strip():
+        chunks.append(buffer.strip())
+    return chunks
+
+def count_bad_cuts(reply, chunks):
+    # Cuts right after "1." or "e.g." that aren't line breaks split a list item or a sentence
+    bad = 0
+    position = 0
+    for chunk in chunks[:-1]:
+        position = reply.index(chunk, position) + len(chunk)
+        words = chunk.split()
+        if chunk.endswith(".") and ABBREVIATION.fullmatch(words[-1][:-1]) and not reply.startswith("\n", position):
+            bad += 1
+    return bad
+
+def run_stream_benchmark(rounds):
+    replies = STREAMED_REPLIES * max(1, rounds // 10)
+    start = time.perf_counter()
+    # Token-sized deltas, like the API sends
+    splits = [stream_chunks(reply, 4) for reply in replies]
+    elapsed = time.perf_counter() - start
+    bad_cuts = sum(count_bad_cuts(reply, chunks) for reply, chunks in zip(replies, splits))
+    print(f"split_stream_buffer: {len(replies)} replies in {elapsed:.3f}s "
+          f"({elapsed / len(replies) * 1e6:,.1f} us/reply), {sum(map(len, splits))} chunks, "
+          f"{bad_cuts} chunks ending after a list number or abbreviation")
+
+# Modules whose import time adds to every cold start and worker spawn
+STARTUP_MODULES = ["main", "services", "workers", "ai_handler", "database_handler", "instagram_api", "message_handler", "reminder_bot"]
+
+def run_imports_benchmark(rounds):
+    src = os.path.dirname(os.path.abspath(__file__))
+    # A fresh interpreter per module, otherwise everything after the first import is cached
+    runs = max(1, min(rounds // 1000, 5))
+    for module in STARTUP_MODULES:
+        timings = []
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=src,
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"import {module}: failed ({result.stderr.strip().splitlines()[-1]})")
+                break
+            # The last line is the module itself: "import time: self | cumulative | name"
+            timings.append(int(result.stderr.strip().splitlines()[-1].split("|")[1]) / 1000)
+        else:
+            print(f"import {module}: {min(timings):,.1f} ms (best of {runs})")
+
+BENCHMARKS = {
+    "extraction": run_extraction_benchmark,
+    "language": run_language_benchmark,
+    "split": run_split_benchmark,
+    "stream": run_stream_benchmark,
+    "imports": run_imports_benchmark,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the hot paths of the bot")
+    parser.add_argument("benchmark", nargs="?", choices=sorted(BENCHMARKS), help="Benchmark to run (default: all)")
+    parser.add_argument("--rounds", type=int, default=2000, help="How many times to repeat the corpus")
+    args = parser.parse_args()
+    for name, benchmark in BENCHMARKS.items():
+        if args.benchmark in (None, name):
+            benchmark(args.rounds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+class TTLCache:
+    """
+    Bounded in-process cache with least-recently-used eviction and per-entry expiry.
+    """
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=MISSING):
+        """
+        Look up a key, counting the hit or miss.
+
+        :return: Cached value, or default (MISSING) when absent or expired
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return default
+
+    def peek(self, key, default=MISSING):
+        # Like get, but without touching the LRU order or the counters
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] > self.clock():
+            return entry[0]
+        return default
+
+    def put(self, key, value):
+        self.entries[key] = (value, self.clock() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
@@ -1,49 +1,100 @@
 import os
-from supabase import create_client, Client
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import logging
 from typing import Dict, Any, Optional, List
+from cache import TTLCache, MISSING
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+_supabase = None
 
-async def save_or_update_client_data(instagram_id: str, client_data: Dict[str, Any]) -> bool:
+def get_supabase():
     """
-    Save or update client data in Supabase database.
-    
+    Return the Supabase client, creating it on first use.
+
+    The supabase package takes a noticeable part of a second to import, so this
+    keeps it off the startup path until the first query.
+    """
+    global _supabase
+    if _supabase is None:
+        from supabase import create_client
+        _supabase = create_client(url, key)
+        # Create the PostgREST client (and its keep-alive connection pool) once, before worker threads use it
+        _supabase.postgrest
+    return _supabase
+
+# The supabase client is synchronous; its queries run on this bounded pool so a
+# slow round-trip never blocks the event loop
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", 8))
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+async def run_query(query):
+    """
+    Execute a PostgREST query builder without blocking the event loop.
+
+    :param query: Query builder, e.g. get_supabase().table("clients").select("*")
+    :return: The query's APIResponse
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, query.execute)
+
+# postgrest.types.ReturnMethod.minimal, without importing postgrest at startup
+RETURN_MINIMAL = "minimal"
+
+def shutdown_db_executor():
+    db_executor.shutdown(wait=True)
+
+# Read-through cache of client rows keyed by instagram_id (None caches "not found")
+CLIENT_CACHE_MAX_SIZE = int(os.getenv("CLIENT_CACHE_MAX_SIZE", 5000))
+CLIENT_CACHE_TTL = float(os.getenv("CLIENT_CACHE_TTL", 300))  # seconds
+client_cache = TTLCache(CLIENT_CACHE_MAX_SIZE, CLIENT_CACHE_TTL)
+
+# [reads in flight, writes seen] per instagram_id, so a read that raced with
+# one of our writes doesn't put its stale row into the cache
+_reads_in_flight: Dict[str, List[int]] = {}
+
+def update_cached_client(instagram_id: str, fields: Dict[str, Any]) -> None:
+    """
+    Apply one of our own writes to the cached client row.
+
     :param instagram_id: Instagram ID of the client
-    :param client_data: Dictionary containing client information
+    :param fields: Fields that were written
+    """
+    cached = client_cache.peek(instagram_id)
+    if isinstance(cached, dict):
+        client_cache.put(instagram_id, dict(cached, **fields))
+    else:
+        client_cache.invalidate(instagram_id)
+    if instagram_id in _reads_in_flight:
+        _reads_in_flight[instagram_id][1] += 1
+
+def get_cache_metrics() -> Dict[str, Any]:
+    return client_cache.get_metrics()
+
+async def bulk_upsert_client_data(rows: List[Dict[str, Any]]) -> bool:
+    """
+    Save or update several clients in one request.
+
+    :param rows: Client rows, each including instagram_id and the same set of columns
     :return: True if successful, False otherwise
     """
     try:
-        # Ensure instagram_id is in the client_data
-        client_data['instagram_id'] = instagram_id
-
-        # Check if the client already exists
-        existing_data = await get_client_data(instagram_id)
-        
-        if existing_data:
-            # Update existing record
-            response = supabase.table("clients").update(client_data).eq("instagram_id", instagram_id).execute()
-        else:
-            # Insert new record
-            response = supabase.table("clients").insert(client_data).execute()
-        
-        if response.data:
-            logger.info(f"Successfully saved/updated client data for Instagram ID: {instagram_id}")
-            return True
-        else:
-            logger.error(f"Failed to save/update client data: {response.error}")
-            return False
+        await run_query(get_supabase().table("clients").upsert(
+            rows, on_conflict="instagram_id", returning=RETURN_MINIMAL
+        ))
+        for row in rows:
+            update_cached_client(row['instagram_id'], row)
+        logger.info(f"Successfully saved/updated {len(rows)} clients")
+        return True
     except Exception as e:
-        logger.error(f"Error saving/updating client data: {str(e)}")
+        logger.error(f"Error bulk saving client data: {str(e)}")
         return False
 
 async def get_client_data(instagram_id: str) -> Optional[Dict[str, Any]]:
@@ -53,39 +104,90 @@ async def get_client_data(instagram_id: str) -> Optional[Dict[str, Any]]:
     :param instagram_id: Instagram ID of the client
     :return: Client data if found, None otherwise
     """
+    cached = client_cache.get(instagram_id)
+    if cached is not MISSING:
+        return dict(cached) if cached is not None else None
+
+    tracker = _reads_in_flight.setdefault(instagram_id, [0, 0])
+    tracker[0] += 1
+    writes_before = tracker[1]
     try:
-        response = supabase.table("clients").select("*").eq("instagram_id", instagram_id).execute()
-        data = response.data
+        response = await run_query(get_supabase().table("clients").select("*").eq("instagram_id", instagram_id))
+        data = response.data[0] if response.data else None
+        if tracker[1] == writes_before:
+            client_cache.put(instagram_id, data)
         if data:
-            return data[0]
+            return dict(data)
         else:
             logger.info(f"No client data found for Instagram ID: {instagram_id}")
             return None
     except Exception as e:
         logger.error(f"Error retrieving client data: {str(e)}")
         return None
+    finally:
+        tracker[0] -= 1
+        if tracker[0] == 0:
+            del _reads_in_flight[instagram_id]
 
-async def get_clients_for_reminders() -> List[Dict[str, Any]]:
+REMINDER_COLUMNS = "instagram_id, name, final_decision, paid, language, last_message_at, next_reminder_at, reminder_stage"
+
+async def get_due_reminders(due_before: str, limit: int) -> List[Dict[str, Any]]:
     """
-    Retrieve clients who need reminders (final decision is uncertain or haven't paid).
-    
-    :return: List of client data for those who need reminders
+    Retrieve one page of clients whose next reminder is due, oldest first.
+
+    :param due_before: ISO timestamp; reminders due at or before it are returned
+    :param limit: Page size
+    :return: List of client rows with the reminder columns
     """
     try:
-        response = supabase.table("clients").select("*").or_(
-            "final_decision.eq.Uncertain,final_decision.eq.Leaning Towards Yes,final_decision.eq.Leaning Towards No,paid.eq.false"
-        ).execute()
-        data = response.data
-        if data:
-            logger.info(f"Retrieved {len(data)} clients for reminders")
-            return data
-        else:
-            logger.info("No clients found for reminders")
-            return []
+        response = await run_query(
+            get_supabase().table("clients").select(REMINDER_COLUMNS)
+            .lte("next_reminder_at", due_before)
+            .order("next_reminder_at")
+            .limit(limit)
+        )
+        return response.data or []
     except Exception as e:
-        logger.error(f"Error retrieving clients for reminders: {str(e)}")
+        logger.error(f"Error retrieving due reminders: {str(e)}")
         return []
 
+async def count_due_reminders(due_before: str) -> int:
+    """
+    Count the clients whose next reminder is due, to pace a reminder run.
+
+    :param due_before: ISO timestamp; reminders due at or before it are counted
+    :return: Number of due reminders, 0 on error
+    """
+    try:
+        response = await run_query(
+            get_supabase().table("clients").select("instagram_id", count="exact")
+            .lte("next_reminder_at", due_before)
+            .limit(1)
+        )
+        return response.count or 0
+    except Exception as e:
+        logger.error(f"Error counting due reminders: {str(e)}")
+        return 0
+
+async def get_next_reminder_time(after: str) -> Optional[str]:
+    """
+    Find when the next reminder after the given time is due.
+
+    :param after: ISO timestamp
+    :return: ISO timestamp of the next due reminder, or None if nothing is scheduled
+    """
+    try:
+        response = await run_query(
+            get_supabase().table("clients").select("next_reminder_at")
+            .gt("next_reminder_at", after)
+            .order("next_reminder_at")
+            .limit(1)
+        )
+        return response.data[0]['next_reminder_at'] if response.data else None
+    except Exception as e:
+        logger.error(f"Error retrieving next reminder time: {str(e)}")
+        return None
+
 async def verify_supabase_connection() -> bool:
     """
     Verify the Supabase connection by performing a simple query.
@@ -93,7 +195,7 @@ async def verify_supabase_connection() -> bool:
     :return: True if connection is successful, False otherwise
     """
     try:
-        response = supabase.table('clients').select('instagram_id').limit(1).execute()
+        response = await run_query(get_supabase().table('clients').select('instagram_id').limit(1))
         if response.data is not None:
             logger.info("Supabase connection verified successfully")
             return True
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DebounceScheduler:
+    """
+    Per-key debounce timers built on the event loop's timer handles.
+
+    Every schedule() call pushes the key's deadline back by the quiet period,
+    but never past first_call + max_wait, so a sender who keeps typing still
+    gets a reply. The callback fires once per burst with the key as argument.
+    """
+    def __init__(self, callback, quiet_period, max_wait):
+        self.callback = callback
+        self.quiet_period = quiet_period
+        self.max_wait = max(max_wait, quiet_period)
+        self.timers = {}
+
+    def schedule(self, key):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if key in self.timers:
+            handle, first_time = self.timers[key]
+            handle.cancel()
+        else:
+            first_time = now
+        delay = max(0, min(self.quiet_period, first_time + self.max_wait - now))
+        handle = loop.call_later(delay, self._fire, key)
+        self.timers[key] = (handle, first_time)
+
+    def _fire(self, key):
+        self.timers.pop(key, None)
+        try:
+            self.callback(key)
+        except Exception as e:
+            logger.error(f"Debounce callback failed for {key}: {e}")
+
+    def cancel(self, key):
+        entry = self.timers.pop(key, None)
+        if entry:
+            entry[0].cancel()
+
+    def flush(self):
+        """
+        Cancel all pending timers.
+
+        :return: Keys whose timers were still pending
+        """
+        keys = list(self.timers)
+        for key in keys:
+            self.cancel(key)
+        return keys
+
+    def __len__(self):
+        return len(self.timers)
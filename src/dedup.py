@@ -0,0 +1,82 @@
+import os
+import logging
+from cache import TTLCache, MISSING
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "redis" if os.getenv("REDIS_URL") else "memory")
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", 24 * 3600))  # seconds a message id is remembered; Meta redelivers for hours
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", 100000))
+
+class MemoryDedupIndex:
+    """
+    Process-local index of seen message keys with per-key expiry.
+    """
+    def __init__(self, ttl=DEDUP_TTL, max_entries=DEDUP_MAX_ENTRIES):
+        self.seen = TTLCache(max_entries, ttl)
+        self.checked = 0
+        self.duplicates = 0
+
+    async def check_and_add(self, key):
+        """
+        Record a message key.
+
+        :return: True if the key was already seen within the TTL
+        """
+        self.checked += 1
+        if self.seen.peek(key) is not MISSING:
+            self.duplicates += 1
+            return True
+        self.seen.put(key, True)
+        return False
+
+    def get_metrics(self):
+        return {"backend": "memory", "size": len(self.seen), "checked": self.checked, "duplicates": self.duplicates}
+
+class RedisDedupIndex:
+    """
+    Index shared by all worker processes: a key is claimed with one SET NX EX.
+    Falls back to a process-local index while Redis is unreachable.
+    """
+    def __init__(self, redis, ttl=DEDUP_TTL, prefix="dedup:"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self.fallback = MemoryDedupIndex(ttl)
+        self.checked = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    async def check_and_add(self, key):
+        self.checked += 1
+        try:
+            claimed = await self.redis.set(self.prefix + key, 1, nx=True, ex=self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Redis dedup check failed, using the local index: {e}")
+            return await self.fallback.check_and_add(key)
+        if not claimed:
+            self.duplicates += 1
+            return True
+        return False
+
+    def get_metrics(self):
+        return {"backend": "redis", "checked": self.checked, "duplicates": self.duplicates, "errors": self.errors}
+
+def create_dedup_index(name=DEDUP_BACKEND):
+    if name == "redis":
+        redis = get_redis()
+        if redis is not None:
+            logger.info("Using Redis message dedup index")
+            return RedisDedupIndex(redis)
+        logger.error("DEDUP_BACKEND is redis but REDIS_URL is not set, falling back to memory")
+    return MemoryDedupIndex()
+
+_dedup_index = None
+
+def get_dedup_index():
+    global _dedup_index
+    if _dedup_index is None:
+        _dedup_index = create_dedup_index()
+    return _dedup_index
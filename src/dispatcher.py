@@ -0,0 +1,106 @@
+import asyncio
+import os
+import logging
+import traceback
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_MAX_CONCURRENCY = int(os.getenv("DISPATCH_MAX_CONCURRENCY", 20))
+DISPATCH_MAX_BACKLOG = int(os.getenv("DISPATCH_MAX_BACKLOG", 1000))  # queued or running jobs before producers wait
+
+class KeyedDispatcher:
+    """
+    Run jobs in submission order per key while different keys run concurrently.
+
+    Each active key gets one drain task that works through its own FIFO of jobs,
+    and a global semaphore caps how many jobs run at the same time. Producers that
+    can apply back-pressure call wait_for_room after submitting, which holds them
+    while max_backlog jobs are queued or running.
+    """
+    def __init__(self, max_concurrency=DISPATCH_MAX_CONCURRENCY, name="dispatcher", max_backlog=None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_backlog = max_backlog
+        self.backlog = 0
+        self.has_room = None
+        self.semaphore = None
+        self.pending = {}
+        self.drainers = {}
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, job):
+        """
+        Queue a job for a key.
+
+        :param key: Ordering key, e.g. the sender ID
+        :param job: Zero-argument callable returning a coroutine
+        :return: Future resolved with the job's result
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.has_room = asyncio.Event()
+            self.has_room.set()
+        self.backlog += 1
+        if self.max_backlog is not None and self.backlog >= self.max_backlog:
+            self.has_room.clear()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(key, deque()).append((job, future))
+        if key not in self.drainers:
+            self.drainers[key] = asyncio.create_task(self._drain(key))
+        return future
+
+    async def _drain(self, key):
+        queue = self.pending[key]
+        try:
+            while queue:
+                job, future = queue.popleft()
+                async with self.semaphore:
+                    self.running += 1
+                    try:
+                        result = await job()
+                        self.completed += 1
+                        if not future.done():
+                            future.set_result(result)
+                    except Exception as e:
+                        self.failed += 1
+                        logger.error(f"{self.name}: job for {key} failed: {e}")
+                        logger.error(traceback.format_exc())
+                        if not future.done():
+                            future.set_exception(e)
+                            # Already logged; callers that don't await the future shouldn't warn again
+                            future.exception()
+                    finally:
+                        self.running -= 1
+                        self.backlog -= 1
+                        if self.max_backlog is None or self.backlog < self.max_backlog:
+                            self.has_room.set()
+        finally:
+            del self.pending[key]
+            del self.drainers[key]
+
+    async def wait_for_room(self):
+        """
+        Wait until the backlog is below max_backlog.
+        """
+        if self.has_room is not None:
+            await self.has_room.wait()
+
+    async def drain(self):
+        """
+        Wait until every queued job, including ones submitted while waiting, has run.
+        """
+        while self.drainers:
+            await asyncio.gather(*list(self.drainers.values()), return_exceptions=True)
+
+    def get_metrics(self):
+        return {
+            "active_keys": len(self.drainers),
+            "queued": sum(len(queue) for queue in self.pending.values()),
+            "backlog": self.backlog,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+import logging
+import traceback
+from message_handler import handle_instagram_event
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_MAXSIZE = int(os.getenv("EVENT_QUEUE_MAXSIZE", 1000))
+EVENT_QUEUE_WORKERS = int(os.getenv("EVENT_QUEUE_WORKERS", 4))
+
+class EventQueue:
+    """
+    Bounded in-process queue between the webhook endpoint and the event handlers.
+
+    The webhook handler only enqueues and returns, so Meta gets its 200 right away;
+    a pool of worker tasks drains the queue in the background.
+    """
+    def __init__(self, handler, maxsize=EVENT_QUEUE_MAXSIZE, workers=EVENT_QUEUE_WORKERS):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.worker_count = workers
+        self.queue = None
+        self.workers = []
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.high_water_mark = 0
+        self.total_wait_time = 0.0
+
+    def enqueue(self, event):
+        """
+        Put an event on the queue without waiting.
+
+        :param event: Webhook payload to process
+        :return: True if the event was queued, False if the queue is full or not started
+        """
+        if self.queue is None:
+            logger.error("Event queue is not running, rejecting event")
+            self.rejected += 1
+            return False
+        try:
+            self.queue.put_nowait((time.monotonic(), event))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Event queue is full ({self.maxsize} events), rejecting event")
+            return False
+        self.enqueued += 1
+        depth = self.queue.qsize()
+        if depth > self.high_water_mark:
+            self.high_water_mark = depth
+        return True
+
+    async def put(self, event):
+        """
+        Put an event on the queue, waiting for room. For producers that can apply
+        back-pressure, unlike the webhook endpoint.
+        """
+        await self.queue.put((time.monotonic(), event))
+        self.enqueued += 1
+        depth = self.queue.qsize()
+        if depth > self.high_water_mark:
+            self.high_water_mark = depth
+
+    async def _worker(self, worker_id):
+        while True:
+            enqueued_at, event = await self.queue.get()
+            self.total_wait_time += time.monotonic() - enqueued_at
+            try:
+                await self.handler(event)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Event worker {worker_id} failed to process event: {e}")
+                logger.error(traceback.format_exc())
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"Event queue started with {self.worker_count} workers (maxsize={self.maxsize})")
+
+    async def stop(self, drain_timeout=10):
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Event queue not drained after {drain_timeout}s, {self.queue.qsize()} events dropped")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue = None
+        logger.info("Event queue stopped")
+
+    def get_metrics(self):
+        completed = self.processed + self.failed
+        return {
+            "depth": self.queue.qsize() if self.queue is not None else 0,
+            "maxsize": self.maxsize,
+            "high_water_mark": self.high_water_mark,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_wait_ms": (self.total_wait_time / completed * 1000) if completed else 0.0
+        }
+
+event_queue = EventQueue(handle_instagram_event)
+
+async def start_event_queue():
+    event_queue.start()
+
+def get_event_queue():
+    return event_queue
@@ -0,0 +1,103 @@
+import re
+from typing import Dict, NamedTuple, Tuple, Union
+
+class FieldMatch(NamedTuple):
+    value: Union[str, bool]
+    span: Tuple[int, int]
+
+# Named alternatives of the scanner, tried in this order at every position.
+# Phrase fields only consume their trigger and peek at the value with a lookahead,
+# so entities mentioned inside the value (e-mails, phones, ...) are still found.
+# Order matters where triggers share a start: "i'm from" must win over "i'm",
+# "interested in" over "interested", and e-mails over bare @handles.
+# Patterns run on the lowercased message.
+ENTITY_RULES = [
+    ('city_country', r"(?:i'm from|i am from|i live in|my location is)\s+(?=(?P<city_country_value>[a-z\s,]+))"),
+    ('name', r"(?:my name is|i'm|i am|call me)\s+(?=(?P<name_value>[a-z\s]+))"),
+    ('interests', r"(?:(?P<interested_keyword>interested)\s+in|passion for|excited about)\s+(?=(?P<interests_value>.+?)(?:\.|$))"),
+    ('email', r"\b[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z|]{2,}\b"),
+    ('telegram_username', r"@\w+"),
+    ('phone_number', r"\+?\d{1,4}[-.\s]?\(?\d{1,4}\)?[-.\s]?\d{1,9}[-.\s]?\d{1,9}"),
+]
+
+# Whole-word keywords, matched as one \b(...)\b alternative
+KEYWORD_RULES = [
+    ('decision_joined', r"definitely join|absolutely|sign me up|ready to start|let's do this"),
+    ('decision_leaning_yes', r"considering|leaning towards yes|probably will|sounds good|interested"),
+    ('decision_uncertain', r"not sure|maybe|thinking about it|need more time|uncertain|on the fence"),
+    ('decision_leaning_no', r"probably not|leaning towards no|not convinced|hesitant"),
+    ('decision_not_interested', r"not interested|don't want|no thanks|not for me"),
+    ('paid_yes', r"paid|completed payment|payment sent|transaction done"),
+    ('paid_no', r"haven't paid|not paid|pending payment|still need to pay"),
+]
+
+# When several decisions show up in one message, the earliest in this list wins
+DECISIONS = [
+    ('decision_joined', "Joined"),
+    ('decision_leaning_yes', "Leaning Towards Yes"),
+    ('decision_uncertain', "Uncertain"),
+    ('decision_leaning_no', "Leaning Towards No"),
+    ('decision_not_interested', "Not Interested"),
+]
+DECISION_RANKS = {rule: (rank, value) for rank, (rule, value) in enumerate(DECISIONS)}
+
+PAYMENTS = {'paid_yes': (0, True), 'paid_no': (1, False)}
+
+def _build_scanner(flags=0):
+    alternatives = [f"(?P<{rule}>{pattern})" for rule, pattern in ENTITY_RULES]
+    alternatives.append(r"\b(?:" + "|".join(f"(?P<{rule}>{pattern})" for rule, pattern in KEYWORD_RULES) + r")\b")
+    # Every alternative starts with one of these characters; checking it first
+    # lets the scanner skip most positions without trying each alternative
+    return re.compile(r"(?=[a-z\d_@+])(?:" + "|".join(alternatives) + ")", flags)
+
+SCANNER = _build_scanner()
+# For the rare text whose length changes when lowercased (e.g. "İ"), so spans stay valid
+SCANNER_IGNORECASE = _build_scanner(re.IGNORECASE)
+
+def extract_fields(message: str) -> Dict[str, FieldMatch]:
+    """
+    Extract client information from a message in a single scan.
+
+    :param message: Raw message text
+    :return: Dictionary mapping field names (name, email, telegram_username, phone_number,
+             city_country, interests, final_decision, paid) to the value and its span
+    """
+    fields = {}
+    decision = None
+    payment = None
+    message_lower = message.lower()
+    if len(message_lower) == len(message):
+        matches = SCANNER.finditer(message_lower)
+    else:
+        matches = SCANNER_IGNORECASE.finditer(message)
+    for match in matches:
+        rule = match.lastgroup
+        if rule in DECISION_RANKS:
+            rank, value = DECISION_RANKS[rule]
+            if decision is None or rank < decision[0]:
+                decision = (rank, FieldMatch(value, match.span()))
+        elif rule in PAYMENTS:
+            rank, value = PAYMENTS[rule]
+            if payment is None or rank < payment[0]:
+                payment = (rank, FieldMatch(value, match.span()))
+        elif rule in fields:
+            # Like re.search, the first occurrence of a field wins
+            continue
+        elif rule == 'name' or rule == 'city_country':
+            value_group = f"{rule}_value"
+            fields[rule] = FieldMatch(match.group(value_group).strip().title(), match.span(value_group))
+        elif rule == 'interests':
+            fields[rule] = FieldMatch(match.group('interests_value').strip().lower(), match.span('interests_value'))
+            if match.group('interested_keyword'):
+                rank, value = DECISION_RANKS['decision_leaning_yes']
+                if decision is None or rank < decision[0]:
+                    decision = (rank, FieldMatch(value, match.span('interested_keyword')))
+        else:
+            # Entities keep their original case
+            start, end = match.span()
+            fields[rule] = FieldMatch(message[start:end], (start, end))
+    if decision is not None:
+        fields['final_decision'] = decision[1]
+    if payment is not None:
+        fields['paid'] = payment[1]
+    return fields
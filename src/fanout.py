@@ -0,0 +1,71 @@
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class FanOut:
+    """
+    Runs batches of jobs with bounded parallelism for one run, optionally spreading
+    their start times evenly over a window, and keeps per-run progress and latency.
+    """
+    def __init__(self, concurrency, window=0.0, total=0, name="fanout"):
+        self.name = name
+        self.total = total
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Job n may not start before started_at + n * spacing
+        self.spacing = window / total if window and total else 0.0
+        self.started_at = time.monotonic()
+        self.submitted = 0
+        self.in_flight = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.latencies = []
+
+    async def _run_job(self, job, slot):
+        delay = self.started_at + slot * self.spacing - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with self.semaphore:
+            self.in_flight += 1
+            started = time.monotonic()
+            try:
+                ok = await job()
+            except Exception as e:
+                logger.error(f"{self.name}: job failed: {e}")
+                ok = False
+            finally:
+                self.in_flight -= 1
+            self.latencies.append(time.monotonic() - started)
+            if ok is False:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+
+    async def run(self, jobs):
+        """
+        Run a batch of jobs and wait for all of them.
+
+        :param jobs: Zero-argument callables returning coroutines; a result of False counts as a failure
+        """
+        first_slot = self.submitted
+        self.submitted += len(jobs)
+        await asyncio.gather(*(self._run_job(job, first_slot + index) for index, job in enumerate(jobs)))
+        logger.info(f"{self.name}: {self.succeeded + self.failed}/{max(self.total, self.submitted)} done, "
+                    f"{self.failed} failed, {time.monotonic() - self.started_at:.0f}s elapsed")
+
+    def get_metrics(self):
+        elapsed = time.monotonic() - self.started_at
+        done = self.succeeded + self.failed
+        latencies = sorted(self.latencies)
+        return {
+            "total": max(self.total, self.submitted),
+            "done": done,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "elapsed_s": round(elapsed, 1),
+            "per_minute": round(done / elapsed * 60, 1) if elapsed else 0.0,
+            "avg_latency_s": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "p95_latency_s": round(latencies[int(len(latencies) * 0.95)], 2) if latencies else 0.0
+        }
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import time
+import logging
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 10))  # seconds per startup check
+
+class HealthState:
+    """
+    Results of the startup checks, served by /healthz (liveness) and /readyz (readiness).
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self.checks = {}
+
+    def register(self, name):
+        self.checks[name] = {"status": "pending"}
+
+    async def run_check(self, name, check, timeout=HEALTH_CHECK_TIMEOUT):
+        """
+        Run one check with a timeout and record the result.
+
+        :param check: Zero-argument callable returning a coroutine that resolves to True when healthy
+        :return: True if the check passed
+        """
+        self.register(name)
+        started = time.monotonic()
+        try:
+            ok = bool(await asyncio.wait_for(check(), timeout=timeout))
+            detail = None if ok else "check failed"
+        except asyncio.TimeoutError:
+            ok, detail = False, f"timed out after {timeout}s"
+        except Exception as e:
+            ok, detail = False, str(e)
+        result = {"status": "ok" if ok else "failed", "latency_ms": round((time.monotonic() - started) * 1000)}
+        if detail:
+            result["detail"] = detail
+        self.checks[name] = result
+        if ok:
+            logger.info(f"Health check {name} passed in {result['latency_ms']} ms")
+        else:
+            logger.error(f"Health check {name} failed: {detail}")
+        return ok
+
+    async def run_checks(self, checks):
+        """
+        Run several checks concurrently.
+
+        :param checks: Dictionary mapping check names to zero-argument coroutine factories
+        """
+        for name in checks:
+            self.register(name)
+        await asyncio.gather(*(self.run_check(name, check) for name, check in checks.items()))
+
+    def is_ready(self):
+        # Not ready until the checks have at least been registered
+        return bool(self.checks) and all(check["status"] == "ok" for check in self.checks.values())
+
+    async def handle_healthz(self, request):
+        return web.json_response({"status": "ok", "uptime_s": round(time.time() - self.started_at)})
+
+    async def handle_readyz(self, request):
+        ready = self.is_ready()
+        return web.json_response({"ready": ready, "checks": self.checks}, status=200 if ready else 503)
+
+health_state = HealthState()
+
+def setup_health_routes(app):
+    app.router.add_get('/healthz', health_state.handle_healthz)
+    app.router.add_get('/readyz', health_state.handle_readyz)
+
+def get_health_state():
+    return health_state
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "redis" if os.getenv("REDIS_URL") else "memory")
+HISTORY_SQLITE_PATH = os.getenv("HISTORY_SQLITE_PATH", "conversation_history.db")
+HISTORY_RETENTION = int(os.getenv("HISTORY_RETENTION", 30 * 24 * 3600))  # seconds a stored history is kept
+HISTORY_MEMORY_MAX_USERS = int(os.getenv("HISTORY_MEMORY_MAX_USERS", 10000))
+
+# Compact record format: {"m": [["u", text], ["a", text], ...], "s": summary, "p": [messages awaiting summary]}
+ROLE_CODES = {"user": "u", "assistant": "a"}
+CODE_ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+def _compact_messages(messages):
+    return [[ROLE_CODES[msg["role"]], msg["content"]] for msg in messages]
+
+def _expand_messages(compact):
+    return [{"role": CODE_ROLES[code], "content": content} for code, content in compact]
+
+def serialize_history(record):
+    compact = {"m": _compact_messages(record["messages"])}
+    if record.get("summary"):
+        compact["s"] = record["summary"]
+    if record.get("pending"):
+        compact["p"] = _compact_messages(record["pending"])
+    return json.dumps(compact, ensure_ascii=False, separators=(',', ':'))
+
+def deserialize_history(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    compact = json.loads(data)
+    return {
+        "messages": _expand_messages(compact.get("m", [])),
+        "summary": compact.get("s", ""),
+        "pending": _expand_messages(compact.get("p", []))
+    }
+
+class MemoryHistoryBackend:
+    """
+    Process-local store, bounded to HISTORY_MEMORY_MAX_USERS users; lost on restart.
+    """
+    def __init__(self, max_users=HISTORY_MEMORY_MAX_USERS):
+        self.max_users = max_users
+        self.records = OrderedDict()
+
+    async def load(self, user_id):
+        data = self.records.get(user_id)
+        return deserialize_history(data) if data is not None else None
+
+    async def save(self, user_id, record):
+        self.records[user_id] = serialize_history(record)
+        self.records.move_to_end(user_id)
+        while len(self.records) > self.max_users:
+            self.records.popitem(last=False)
+
+    async def delete(self, user_id):
+        self.records.pop(user_id, None)
+
+    async def close(self):
+        pass
+
+class SQLiteHistoryBackend:
+    """
+    SQLite file store. All queries run on one dedicated thread that owns the connection.
+    """
+    def __init__(self, path=HISTORY_SQLITE_PATH, retention=HISTORY_RETENTION):
+        self.path = path
+        self.retention = retention
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-sqlite")
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_history "
+                "(user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            # Drop conversations nobody touched within the retention period
+            self.connection.execute("DELETE FROM conversation_history WHERE updated_at < ?", (time.time() - self.retention,))
+            self.connection.commit()
+        return self.connection
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def _load(self, user_id):
+        row = self._connect().execute("SELECT data FROM conversation_history WHERE user_id = ?", (user_id,)).fetchone()
+        return deserialize_history(row[0]) if row else None
+
+    def _save(self, user_id, data):
+        connection = self._connect()
+        connection.execute(
+            "INSERT INTO conversation_history (user_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (user_id, data, time.time())
+        )
+        connection.commit()
+
+    def _delete(self, user_id):
+        connection = self._connect()
+        connection.execute("DELETE FROM conversation_history WHERE user_id = ?", (user_id,))
+        connection.commit()
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def load(self, user_id):
+        return await self._run(self._load, user_id)
+
+    async def save(self, user_id, record):
+        await self._run(self._save, user_id, serialize_history(record))
+
+    async def delete(self, user_id):
+        await self._run(self._delete, user_id)
+
+    async def close(self):
+        await self._run(self._close)
+        self.executor.shutdown(wait=True)
+
+class RedisHistoryBackend:
+    """
+    Redis (or any Redis-compatible server) store; keys expire after HISTORY_RETENTION seconds.
+    """
+    def __init__(self, redis, retention=HISTORY_RETENTION, prefix="history:"):
+        self.redis = redis
+        self.retention = retention
+        self.prefix = prefix
+
+    async def load(self, user_id):
+        data = await self.redis.get(self.prefix + user_id)
+        return deserialize_history(data) if data is not None else None
+
+    async def save(self, user_id, record):
+        await self.redis.set(self.prefix + user_id, serialize_history(record), ex=self.retention)
+
+    async def delete(self, user_id):
+        await self.redis.delete(self.prefix + user_id)
+
+    async def close(self):
+        # The connection is shared, redis_client closes it
+        pass
+
+def create_history_backend(name=HISTORY_BACKEND):
+    if name == "sqlite":
+        logger.info(f"Using SQLite conversation history at {HISTORY_SQLITE_PATH}")
+        return SQLiteHistoryBackend()
+    if name == "redis":
+        redis = get_redis()
+        if redis is not None:
+            logger.info("Using Redis conversation history")
+            return RedisHistoryBackend(redis)
+        logger.error("HISTORY_BACKEND is redis but REDIS_URL is not set, falling back to memory")
+    return MemoryHistoryBackend()
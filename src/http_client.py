@@ -0,0 +1,64 @@
+import aiohttp
+import os
+import logging
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Connection pool settings
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 60))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+
+# Timeouts, in seconds, for every outbound call
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+ANTHROPIC_TIMEOUT = aiohttp.ClientTimeout(
+    total=float(os.getenv("ANTHROPIC_TIMEOUT", 30)),
+    connect=HTTP_CONNECT_TIMEOUT
+)
+GRAPH_API_TIMEOUT = aiohttp.ClientTimeout(
+    total=float(os.getenv("GRAPH_API_TIMEOUT", 15)),
+    connect=HTTP_CONNECT_TIMEOUT
+)
+
+_session = None
+
+def _create_session():
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True
+    )
+    logger.info(
+        f"Created shared HTTP session (limit={HTTP_POOL_LIMIT}, "
+        f"limit_per_host={HTTP_POOL_LIMIT_PER_HOST}, dns_ttl={HTTP_DNS_CACHE_TTL}s)"
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+async def start_http_client():
+    get_session()
+
+def get_session():
+    """
+    Return the process-wide aiohttp session, creating it on first use.
+
+    The session keeps keep-alive connection pools per host, so every
+    Anthropic and Graph API call after the first one skips TCP+TLS setup.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+async def close_http_client():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Shared HTTP session closed")
+    _session = None
@@ -1,8 +1,12 @@
 import aiohttp
+import asyncio
 import os
 import json
 from dotenv import load_dotenv
 import logging
+from http_client import get_session, GRAPH_API_TIMEOUT
+from send_pipeline import get_send_pipeline
+from message_splitter import split_message
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -12,116 +16,78 @@ load_dotenv()
 
 INSTAGRAM_TOKEN = os.getenv("INSTAGRAM_TOKEN")
 
-logger.info(f"Debug: INSTAGRAM_TOKEN = {INSTAGRAM_TOKEN}")  # Debug line
-
-def split_message(message, chunk_size=1000):
-    return [message[i:i+chunk_size] for i in range(0, len(message), chunk_size)]
-
 async def send_message(recipient_id, message):
     url = f"https://graph.facebook.com/v12.0/me/messages"
     
-    message_chunks = split_message(message)
-    success = True
+    requests = [{'json': {
+        'recipient': {'id': recipient_id},
+        'message': {'text': chunk},
+        'access_token': INSTAGRAM_TOKEN
+    }} for chunk in split_message(message)]
 
-    async with aiohttp.ClientSession() as session:
-        for chunk in message_chunks:
-            payload = {
-                'recipient': {'id': recipient_id},
-                'message': {'text': chunk},
-                'access_token': INSTAGRAM_TOKEN
-            }
-            
-            try:
-                async with session.post(url, json=payload) as response:
-                    await response.text()
-                    response.raise_for_status()
-                logger.info(f"Successfully sent message chunk to {recipient_id}")
-            except aiohttp.ClientError as e:
-                logger.error(f"Failed to send message chunk. Error: {e}")
-                if response.text:
-                    try:
-                        error_data = json.loads(await response.text())
-                        logger.error(f"Error details: {json.dumps(error_data, indent=2)}")
-                    except json.JSONDecodeError:
-                        logger.error(f"Raw error response: {await response.text()}")
-                success = False
-                break
-    
+    # Retried, rate limited and kept in order with other sends to this recipient
+    success = await get_send_pipeline().send(recipient_id, url, requests)
+    if success:
+        logger.info(f"Successfully sent {len(requests)} message chunks to {recipient_id}")
     return success
 
 async def reply_to_comment(comment_id, message):
     reply_url = f"https://graph.facebook.com/v12.0/{comment_id}/replies"
     
-    message_chunks = split_message(message)
-    success = True
+    requests = [{'data': {
+        'message': chunk,
+        'access_token': INSTAGRAM_TOKEN
+    }} for chunk in split_message(message)]
 
-    async with aiohttp.ClientSession() as session:
-        for chunk in message_chunks:
-            data = {
-                'message': chunk,
-                'access_token': INSTAGRAM_TOKEN
-            }
-            
-            try:
-                async with session.post(reply_url, data=data) as response:
-                    await response.text()
-                    response.raise_for_status()
-                logger.info(f"Successfully replied to comment {comment_id} with chunk")
-            except aiohttp.ClientError as e:
-                logger.error(f"Failed to reply to comment. Error: {e}")
-                if response.text:
-                    try:
-                        error_data = json.loads(await response.text())
-                        logger.error(f"Error details: {json.dumps(error_data, indent=2)}")
-                    except json.JSONDecodeError:
-                        logger.error(f"Raw error response: {await response.text()}")
-                success = False
-                break
-    
+    success = await get_send_pipeline().send(comment_id, reply_url, requests)
+    if success:
+        logger.info(f"Successfully replied to comment {comment_id} with {len(requests)} chunks")
     return success
 
 async def fetch_comment_text(comment_id):
-    comment_url = f"https://graph.facebook.com/v12.0/{comment_id}?fields=text&access_token={INSTAGRAM_TOKEN}"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(comment_url) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data.get('text', '')
-        except aiohttp.ClientError as e:
-            logger.error(f"Failed to fetch comment. Error: {e}")
-            if response.text:
+    # The token goes in params so it never shows up in a logged URL
+    comment_url = f"https://graph.facebook.com/v12.0/{comment_id}"
+    session = get_session()
+    try:
+        async with session.get(comment_url, params={"fields": "text", "access_token": INSTAGRAM_TOKEN},
+                               timeout=GRAPH_API_TIMEOUT) as response:
+            text = await response.text()
+            if response.status >= 400:
+                logger.error(f"Failed to fetch comment {comment_id} with status {response.status}")
                 try:
-                    error_data = json.loads(await response.text())
-                    logger.error(f"Error details: {json.dumps(error_data, indent=2)}")
+                    logger.error(f"Error details: {json.dumps(json.loads(text), indent=2)}")
                 except json.JSONDecodeError:
-                    logger.error(f"Raw error response: {await response.text()}")
-            return None
+                    logger.error(f"Raw error response: {text}")
+                return None
+            return json.loads(text).get('text', '')
+    except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to fetch comment {comment_id}. Error: {type(e).__name__}: {e}")
+        return None
 
 async def verify_instagram_token():
-    url = f"https://graph.facebook.com/v12.0/me?access_token={INSTAGRAM_TOKEN}"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url) as response:
-                await response.text()
-                response.raise_for_status()
-            logger.info("Instagram token is valid")
-            return True
-        except aiohttp.ClientError as e:
-            logger.error(f"Instagram token verification failed. Error: {e}")
-            if response.text:
+    # The token goes in params so it never shows up in the logged URL
+    url = "https://graph.facebook.com/v12.0/me"
+    session = get_session()
+    try:
+        async with session.get(url, params={"access_token": INSTAGRAM_TOKEN}, timeout=GRAPH_API_TIMEOUT) as response:
+            text = await response.text()
+            if response.status >= 400:
+                logger.error(f"Instagram token verification failed with status {response.status}")
                 try:
-                    error_data = json.loads(await response.text())
-                    logger.error(f"Error details: {json.dumps(error_data, indent=2)}")
+                    logger.error(f"Error details: {json.dumps(json.loads(text), indent=2)}")
                 except json.JSONDecodeError:
-                    logger.error(f"Raw error response: {await response.text()}")
-            return False
+                    logger.error(f"Raw error response: {text}")
+                return False
+        logger.info("Instagram token is valid")
+        return True
+    except aiohttp.ClientError as e:
+        logger.error(f"Instagram token verification failed. Error: {e}")
+        return False
 
-# Debug function to print all environment variables
-def print_env_vars():
-    logger.info("Debug: All environment variables:")
-    for key, value in os.environ.items():
-        logger.info(f"{key}: {value}")
+CONFIG_VARS = ["VERIFY_TOKEN", "INSTAGRAM_TOKEN", "ANTHROPIC_API_KEY", "SUPABASE_URL", "SUPABASE_KEY", "REDIS_URL"]
 
-# Call the debug function
-print_env_vars()
\ No newline at end of file
+# Debug function to show which configuration variables are set; values are secrets and never logged
+def print_env_vars():
+    logger.info("Debug: Configuration variables:")
+    for key in CONFIG_VARS:
+        logger.info(f"{key}: {'set' if os.getenv(key) else 'not set'}")
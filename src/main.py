@@ -2,14 +2,18 @@ import asyncio
 from aiohttp import web
 from dotenv import load_dotenv
 from instagram_api import verify_instagram_token, print_env_vars
-from ai_handler import generate_ai_response
-from reminder_bot import start_reminder_bot, get_reminder_bot
+from ai_handler import generate_system_message
+from reminder_bot import start_reminder_bot
 import os
+import signal
 import sys
 import logging
 from webhook_handler import setup_routes
-from message_handler import handle_message, process_pending_batches
 from database_handler import verify_supabase_connection
+from event_queue import start_event_queue, get_event_queue
+from services import start_services, stop_services, format_metrics
+from workers import WorkerPool, WORKER_PROCESSES
+from health import setup_health_routes, get_health_state
 import traceback
 
 # Load environment variables
@@ -20,6 +24,8 @@ INSTAGRAM_TOKEN = os.getenv("INSTAGRAM_TOKEN")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Spends an LLM call on every boot, so it is off unless asked for
+STARTUP_SMOKE_TEST = os.getenv("STARTUP_SMOKE_TEST", "false").lower() in ("1", "true", "yes")
 
 def setup_logging():
     level = logging.DEBUG if not os.getenv('DYNO') else logging.INFO
@@ -28,70 +34,71 @@ def setup_logging():
 
 logger = setup_logging()
 
-async def process_batches_periodically():
-    logger.debug("Starting periodic batch processing")
-    while True:
-        try:
-            batch_count = await process_pending_batches()
-            if batch_count > 0:
-                logger.info(f"Processed {batch_count} batches")
-            await asyncio.sleep(5)  # Check every 5 seconds
-        except asyncio.CancelledError:
-            logger.info("Batch processing task cancelled")
-            break
-        except Exception as e:
-            logger.error(f"Error in batch processing: {e}")
-            logger.error(traceback.format_exc())
+async def run_smoke_test():
+    test_message = "Tell me about your programming course"
+    logger.info(f"Testing AI response generation with message: '{test_message}'")
+    # System-initiated, so the test never touches conversation history or the clients table
+    ai_response = await generate_system_message(test_message, "Answer the question briefly.", max_tokens=100)
+    logger.info(f"AI response: {ai_response}")
+    return ai_response is not None
+
+async def run_startup_checks():
+    """
+    Verify the external dependencies concurrently, each with a timeout. A failed
+    check is logged and keeps /readyz unready instead of stopping the server.
+    """
+    checks = {
+        "instagram": verify_instagram_token,
+        "supabase": verify_supabase_connection,
+    }
+    if STARTUP_SMOKE_TEST:
+        checks["ai"] = run_smoke_test
+    health_state = get_health_state()
+    await health_state.run_checks(checks)
+    if health_state.is_ready():
+        logger.info("All startup checks passed")
+    else:
+        logger.error(f"Startup checks failed, see /readyz: {health_state.checks}")
 
 async def main():
     logger.info("Starting the AI Consultant...")
     
-    # Print all environment variables for debugging
+    # Log which environment variables are set (never their values)
     print_env_vars()
 
     if not all([VERIFY_TOKEN, INSTAGRAM_TOKEN, ANTHROPIC_API_KEY, SUPABASE_URL, SUPABASE_KEY]):
         logger.error("One or more required environment variables are not set.")
         sys.exit(1)
-    
-    # Verify Instagram token
-    logger.info("Verifying Instagram token...")
-    if not await verify_instagram_token():
-        logger.error("Instagram token is invalid or has expired. Please update the token in the .env file.")
-        sys.exit(1)
 
-    # Verify Supabase connection
-    logger.info("Verifying Supabase connection...")
-    if not await verify_supabase_connection():
-        logger.error("Supabase connection failed. Please check your Supabase URL and key in the .env file.")
-        sys.exit(1)
+    # HTTP connection pool, prompt registry and client write buffer
+    await start_services()
 
-    # Test AI response generation
-    test_message = "Tell me about your programming course"
-    test_user_id = "test_user_123"
-    logger.info(f"Testing AI response generation with message: '{test_message}'")
-    try:
-        logger.debug("Calling handle_message function...")
-        ai_response = await handle_message("Test", test_user_id, test_message)
-        logger.info(f"AI response: {ai_response}")
-    except Exception as e:
-        logger.error(f"Error generating AI response: {e}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        sys.exit(1)
-    
-    # Start the reminder bot
-    logger.info("Starting the reminder bot...")
-    try:
-        await start_reminder_bot()
-        logger.info("Reminder bot started successfully")
-    except Exception as e:
-        logger.error(f"Error starting reminder bot: {e}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        sys.exit(1)
+    worker_pool = None
+    if WORKER_PROCESSES > 1:
+        # This process only receives webhooks and routes events to worker processes by sender
+        logger.info(f"Starting {WORKER_PROCESSES} event worker processes...")
+        worker_pool = WorkerPool()
+        worker_pool.start()
+        event_queue = get_event_queue()
+        event_queue.handler = worker_pool.route
+        # Routing is quick; one task keeps the events in webhook order
+        event_queue.worker_count = 1
+    else:
+        # Start the reminder bot
+        logger.info("Starting the reminder bot...")
+        try:
+            await start_reminder_bot()
+            logger.info("Reminder bot started successfully")
+        except Exception as e:
+            logger.error(f"Error starting reminder bot: {e}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            sys.exit(1)
     
     # Setup the server for Instagram webhook
     logger.info("Setting up the server for Instagram webhook...")
     app = web.Application()
     setup_routes(app)
+    setup_health_routes(app)
 
     # Start the server
     runner = web.AppRunner(app)
@@ -101,41 +108,55 @@ async def main():
     port = int(os.environ.get("PORT", 8080))
     host = os.environ.get("HOST", "0.0.0.0")
     site = web.TCPSite(runner, host, port)
+    health_checks_task = None
+    loop = asyncio.get_running_loop()
     
     try:
+        # SIGTERM is how the platform stops the process on every deploy and restart;
+        # cancelling the main loop runs the cleanup below, which flushes buffered work
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+        # Start the webhook event workers before accepting webhooks
+        logger.info("Starting event queue workers...")
+        await start_event_queue()
+
         logger.info(f"Starting the server on {host}:{port}...")
         await site.start()
         logger.info(f"Server started on {host}:{port}")
-        
-        # Start the batch processing coroutine
-        logger.info("Starting batch processing task...")
-        batch_processing_task = asyncio.create_task(process_batches_periodically())
+
+        # Dependency checks run after the port is bound; /readyz reports them
+        health_checks_task = asyncio.create_task(run_startup_checks())
         
         # Run the server indefinitely
         logger.info("Entering main server loop...")
         while True:
             await asyncio.sleep(60)  # Sleep for a minute
-            logger.info("Server is running...")
+            if worker_pool:
+                worker_pool.check_workers()
+                logger.info(f"Server is running... event queue: {get_event_queue().get_metrics()}, workers: {worker_pool.get_metrics()}")
+            else:
+                logger.info(f"Server is running... {format_metrics()}")
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
+    except asyncio.CancelledError:
+        logger.info("Server stopped by SIGTERM")
     except Exception as e:
         logger.error(f"Server error: {e}")
         logger.error(f"Traceback: {traceback.format_exc()}")
     finally:
+        # A second SIGTERM must not interrupt the cleanup
+        loop.add_signal_handler(signal.SIGTERM, logger.info, "Already shutting down")
         logger.info("Cleaning up...")
-        if 'batch_processing_task' in locals():
-            logger.info("Cancelling batch processing task...")
-            batch_processing_task.cancel()
-            try:
-                await batch_processing_task
-            except asyncio.CancelledError:
-                pass
-        logger.info("Stopping reminder bot...")
-        reminder_bot = get_reminder_bot()
-        if reminder_bot:
-            reminder_bot.stop()
+        if health_checks_task:
+            health_checks_task.cancel()
         logger.info("Cleaning up runner...")
         await runner.cleanup()
+        logger.info("Stopping event queue...")
+        await get_event_queue().stop()
+        if worker_pool:
+            logger.info("Stopping event workers...")
+            await asyncio.get_running_loop().run_in_executor(None, worker_pool.stop)
+        await stop_services()
         logger.info("Server closed")
 
 if __name__ == "__main__":
@@ -1,30 +1,53 @@
-from collections import deque
 import time
-from ai_handler import generate_ai_response, extract_client_info
+from ai_handler import generate_ai_response, record_client_message
 from instagram_api import send_message as send_instagram_message, reply_to_comment, fetch_comment_text
 from utils import is_duplicate_message, conversation_history
 from reminder_bot import get_reminder_bot
-from database_handler import save_or_update_client_data
+from dispatcher import KeyedDispatcher, DISPATCH_MAX_BACKLOG
+from debounce import DebounceScheduler
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
-message_queue = deque(maxlen=100)
 reminder_bot = get_reminder_bot()
 
+# Events for one sender run in order, different senders run concurrently
+event_dispatcher = KeyedDispatcher(name="event_dispatcher", max_backlog=DISPATCH_MAX_BACKLOG)
+# Replies (generation and sending) get their own queues, so a sender's slow reply
+# never holds up ingesting their next message or anyone else's events
+reply_dispatcher = KeyedDispatcher(name="reply_dispatcher")
+
 # Message batch storage
 message_batches = {}
-BATCH_TIMEOUT = 5  # seconds
+BATCH_QUIET_PERIOD = float(os.getenv("BATCH_QUIET_PERIOD", 5))  # seconds without new messages
+BATCH_MAX_WAIT = float(os.getenv("BATCH_MAX_WAIT", 15))  # seconds since the first message of a batch
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+
+def schedule_batch_processing(sender_id):
+    # Runs behind any reply still being generated for this sender
+    reply_dispatcher.submit(sender_id, lambda: process_message_batch(sender_id))
+
+batch_scheduler = DebounceScheduler(schedule_batch_processing, BATCH_QUIET_PERIOD, BATCH_MAX_WAIT)
 
 async def handle_instagram_event(event_data):
+    # Submission order keeps events in webhook order per sender, so the queue worker
+    # doesn't wait for them to run; failures are logged by the dispatcher. It does wait
+    # while the dispatcher backlog is full, so the event queue fills up and the webhook
+    # sheds load with 503s instead of the backlog growing without bound
     for entry in event_data.get('entry', []):
         if 'messaging' in entry:
             for messaging_event in entry['messaging']:
-                await handle_instagram_message(messaging_event)
+                sender_id = messaging_event.get('sender', {}).get('id')
+                event_dispatcher.submit(sender_id, lambda event=messaging_event: handle_instagram_message(event))
         elif 'changes' in entry:
             for change in entry.get('changes', []):
                 if change.get('field') == 'mentions':
-                    await handle_instagram_mention(change.get('value', {}))
+                    mention_data = change.get('value', {})
+                    event_dispatcher.submit(
+                        mention_data.get('comment_id'), lambda data=mention_data: handle_instagram_mention(data)
+                    )
+    await event_dispatcher.wait_for_room()
 
 async def handle_instagram_message(message_data):
     sender_id = message_data.get('sender', {}).get('id')
@@ -35,50 +58,54 @@ async def handle_instagram_message(message_data):
     if not sender_id or not message_text or message.get('is_echo', False):
         return
 
-    if is_duplicate_message(message_queue, sender_id, message_text, timestamp):
+    if await is_duplicate_message(sender_id, message, timestamp):
         return
 
-    # Extract client information, including final decision and payment status
-    client_info = extract_client_info(message_text)
-
-    # Update or save client data
-    try:
-        await save_or_update_client_data(sender_id, client_info)
-        logger.info(f"Successfully saved/updated client data for sender {sender_id}")
-    except Exception as e:
-        logger.error(f"Error while saving/updating client data: {str(e)}")
+    # Extract client information, including final decision and payment status, and save what changed
+    await record_client_message(sender_id, message_text)
 
     # Add user to reminder bot tracking
     await reminder_bot.add_user_message(sender_id)
 
     # Add message to batch
     if sender_id not in message_batches:
-        message_batches[sender_id] = {'messages': [], 'last_time': time.time()}
+        message_batches[sender_id] = {'messages': [], 'first_time': time.time()}
     
     message_batches[sender_id]['messages'].append(message_text)
-    message_batches[sender_id]['last_time'] = time.time()
 
     logger.info(f"Added message to batch for sender {sender_id}. Batch size: {len(message_batches[sender_id]['messages'])}")
 
-    # Check if it's time to process the batch
-    if time.time() - message_batches[sender_id]['last_time'] > BATCH_TIMEOUT:
-        await process_message_batch(sender_id)
+    # Reply once the sender goes quiet
+    batch_scheduler.schedule(sender_id)
 
 async def process_message_batch(sender_id):
-    if sender_id not in message_batches:
+    # Take the batch out first so messages arriving during generation start a new one
+    batch = message_batches.pop(sender_id, None)
+    if not batch:
         return
 
-    batch = message_batches[sender_id]
     combined_message = "\n".join(batch['messages'])
 
-    logger.info(f"Processing batch for sender {sender_id} (batch of {len(batch['messages'])} messages)")
-    ai_response = await generate_ai_response(sender_id, combined_message)
+    logger.info(f"Processing batch for sender {sender_id} (batch of {len(batch['messages'])} messages, waited {time.time() - batch['first_time']:.1f}s)")
     
     if sender_id == "test_user":
         # For test messages, just log the response
+        ai_response = await generate_ai_response(sender_id, combined_message)
         logger.info(f"Test message response: {ai_response}")
         success = True
+    elif STREAM_RESPONSES:
+        # Send each chunk as soon as it is complete instead of waiting for the full reply
+        results = []
+
+        async def send_chunk(chunk):
+            success = await send_instagram_message(sender_id, chunk)
+            results.append(success)
+            return success
+
+        await generate_ai_response(sender_id, combined_message, on_chunk=send_chunk)
+        success = bool(results) and all(results)
     else:
+        ai_response = await generate_ai_response(sender_id, combined_message)
         success = await send_instagram_message(sender_id, ai_response)
     
     if success:
@@ -86,15 +113,13 @@ async def process_message_batch(sender_id):
     else:
         logger.error(f"Failed to send Instagram message to sender {sender_id}")
 
-    # Clear the processed batch
-    del message_batches[sender_id]
-
 async def handle_instagram_mention(mention_data):
     comment_id = mention_data.get('comment_id')
     
     if comment_id:
         comment_text = await fetch_comment_text(comment_id)
         if comment_text:
+            await record_client_message(comment_id, comment_text)
             ai_response = await generate_ai_response(comment_id, comment_text)
             success = await reply_to_comment(comment_id, ai_response)
             if not success:
@@ -106,14 +131,20 @@ async def handle_instagram_mention(mention_data):
 
 async def handle_message(platform, user_id, message_text):
     logger.info(f"Generating AI response for {platform} user {user_id}")
+    await record_client_message(str(user_id), message_text)
     ai_response = await generate_ai_response(str(user_id), message_text)
     return ai_response
 
 async def process_pending_batches():
-    processed_batches = 0
-    current_time = time.time()
-    for sender_id, batch in list(message_batches.items()):
-        if current_time - batch['last_time'] > BATCH_TIMEOUT:
-            await process_message_batch(sender_id)
-            processed_batches += 1
-    return processed_batches  # Ensure we always return an integer
\ No newline at end of file
+    """
+    Finish the queued events, then process every batch that is still waiting for
+    its debounce timer and the replies already running, e.g. on shutdown.
+
+    :return: Number of batches processed
+    """
+    await event_dispatcher.drain()
+    sender_ids = batch_scheduler.flush()
+    for sender_id in sender_ids:
+        reply_dispatcher.submit(sender_id, lambda sender_id=sender_id: process_message_batch(sender_id))
+    await reply_dispatcher.drain()
+    return len(sender_ids)
@@ -0,0 +1,158 @@
+import re
+import unicodedata
+from collections import deque
+
+MESSAGE_MAX_BYTES = 1000  # Instagram's limit for a text message, in UTF-8 bytes
+
+# Penalties of cutting at a boundary; among splits with the fewest chunks the
+# one with the lowest total penalty wins
+PARAGRAPH_BREAK = 0
+LINE_BREAK = 1
+SENTENCE_BREAK = 1
+WORD_BREAK = 3
+GRAPHEME_BREAK = 20
+
+WHITESPACE = re.compile(r"\s+")
+PARAGRAPH = re.compile(r"\n[^\S\n]*\n")
+SENTENCE_END = re.compile(r"[.!?…][\"')\]»”]*$")
+
+ZWJ = "\u200d"
+
+def joins_previous(char):
+    """
+    Whether a character continues the grapheme cluster of the one before it
+    (approximation of the Unicode rules for the text we send: combining marks,
+    ZWJ sequences, variation selectors, emoji modifiers and tags).
+    """
+    code = ord(char)
+    return (
+        char == ZWJ
+        or 0xFE00 <= code <= 0xFE0F  # variation selectors
+        or 0x1F3FB <= code <= 0x1F3FF  # skin tone modifiers
+        or 0xE0020 <= code <= 0xE007F  # tag characters (subdivision flags)
+        or 0xE0100 <= code <= 0xE01EF  # variation selectors supplement
+        or unicodedata.category(char) in ("Mn", "Me", "Mc")
+    )
+
+def is_regional_indicator(char):
+    return 0x1F1E6 <= ord(char) <= 0x1F1FF
+
+def grapheme_starts(text, start, end):
+    """
+    Offsets in text[start:end] where a grapheme cluster starts, excluding start.
+    """
+    starts = []
+    pending_flag = False  # after the first letter of a regional indicator pair
+    for index in range(start + 1, end):
+        char = text[index]
+        previous = text[index - 1]
+        if joins_previous(char) or previous == ZWJ or (previous == "\r" and char == "\n"):
+            continue
+        if is_regional_indicator(char) and is_regional_indicator(previous):
+            pending_flag = not pending_flag
+            if pending_flag:
+                continue
+        else:
+            pending_flag = False
+        starts.append(index)
+    return starts
+
+def _candidates(text, max_bytes):
+    """
+    Possible cut positions of a stripped text as (offset, penalty, offset where the chunk content ends).
+    """
+    candidates = []
+    word_start = 0
+    for match in WHITESPACE.finditer(text):
+        space_start, space_end = match.span()
+        if joins_previous(text[space_end]):
+            # A combining mark after a space belongs to the space
+            continue
+        word = text[word_start:space_start]
+        if len(word.encode("utf-8")) > max_bytes:
+            candidates.extend((index, GRAPHEME_BREAK, index) for index in grapheme_starts(text, word_start, space_start))
+        whitespace = match.group()
+        if PARAGRAPH.search(whitespace):
+            penalty = PARAGRAPH_BREAK
+        elif "\n" in whitespace:
+            penalty = LINE_BREAK
+        elif SENTENCE_END.search(word):
+            penalty = SENTENCE_BREAK
+        else:
+            penalty = WORD_BREAK
+        candidates.append((space_end, penalty, space_start))
+        word_start = space_end
+    word = text[word_start:]
+    if len(word.encode("utf-8")) > max_bytes:
+        candidates.extend((index, GRAPHEME_BREAK, index) for index in grapheme_starts(text, word_start, len(text)))
+    candidates.append((len(text), 0, len(text)))
+    return candidates
+
+def split_message(message, max_bytes=MESSAGE_MAX_BYTES):
+    """
+    Split a message into as few chunks of at most max_bytes UTF-8 bytes as possible.
+
+    Among the splits with the fewest chunks, cuts at paragraph breaks are preferred
+    over line and sentence ends, then word boundaries; words are only cut when longer
+    than a whole chunk, and never inside a grapheme cluster (emoji, flags, accents).
+    Whitespace around the cuts is dropped.
+
+    :return: List of chunks, empty for a blank message
+    """
+    message = message.strip()
+    if not message:
+        return []
+    if len(message) * 4 <= max_bytes or len(message.encode("utf-8")) <= max_bytes:
+        return [message]
+
+    candidates = _candidates(message, max_bytes)
+    # Byte offset of every candidate cut and of the content end before it
+    offsets = [0]
+    content_ends = [0]
+    position = 0
+    byte_position = 0
+    for offset, _, content_end in candidates:
+        content_bytes = byte_position + len(message[position:content_end].encode("utf-8"))
+        byte_position = content_bytes + len(message[content_end:offset].encode("utf-8"))
+        position = offset
+        offsets.append(byte_position)
+        content_ends.append(content_bytes)
+
+    # Shortest path over the cut positions with cost (chunks, penalty). The fewest
+    # chunks needed for a prefix never decreases with its length, so the best previous
+    # cut is the lowest-penalty one among the reachable cuts with the lowest count,
+    # which a sliding window minimum finds in linear time.
+    count = len(candidates) + 1
+    chunks = [0] * count
+    penalties = [0] * count
+    previous = [0] * count
+    window = deque([0])
+    first = 0  # first cut the current one can be reached from
+    last = 0  # last cut added to the window
+    for k in range(1, count):
+        while first < k - 1 and content_ends[k] - offsets[first] > max_bytes:
+            first += 1
+        if last < first:
+            last = first
+            window.clear()
+            window.append(first)
+        while last + 1 < k and chunks[last + 1] == chunks[first]:
+            last += 1
+            while window and penalties[window[-1]] >= penalties[last]:
+                window.pop()
+            window.append(last)
+        while window[0] < first:
+            window.popleft()
+        j = window[0]
+        chunks[k] = chunks[j] + 1
+        penalties[k] = penalties[j] + candidates[k - 1][1]
+        previous[k] = j
+
+    cuts = []
+    k = len(candidates)
+    while k > 0:
+        j = previous[k]
+        start = candidates[j - 1][0] if j else 0
+        cuts.append((start, candidates[k - 1][2]))
+        k = j
+    return [message[start:end] for start, end in reversed(cuts)]
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.getenv("PROMPTS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts"))
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", 10))  # seconds
+
+CONSULTANT_PROMPT = "instagram_consultant_prompt.txt"
+SERVICES_PROMPT = "services_context.txt"
+DEFAULT_BASE_CONTEXT = "You are an AI assistant named Dias for an Instagram consultant service."
+
+class PromptRegistry:
+    """
+    In-memory copy of every file under prompts/ plus the precomputed static system context.
+
+    Files are read once; a background watcher compares mtimes and reloads only
+    when something changed, so message handling never touches the disk.
+    """
+    def __init__(self, prompts_dir=PROMPTS_DIR):
+        self.prompts_dir = prompts_dir
+        self.prompts = {}
+        self.mtimes = {}
+        self.static_context = None
+        self.task = None
+
+    def _scan(self):
+        mtimes = {}
+        try:
+            for name in os.listdir(self.prompts_dir):
+                path = os.path.join(self.prompts_dir, name)
+                if os.path.isfile(path):
+                    mtimes[name] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            logger.error(f"Prompts directory not found: {self.prompts_dir}")
+        return mtimes
+
+    def load(self, mtimes=None):
+        if mtimes is None:
+            mtimes = self._scan()
+        prompts = {}
+        for name in mtimes:
+            try:
+                with open(os.path.join(self.prompts_dir, name), 'r') as file:
+                    prompts[name] = file.read()
+            except OSError as e:
+                logger.error(f"Failed to read prompt {name}: {e}")
+        self.prompts = prompts
+        self.mtimes = mtimes
+        self.static_context = self._build_static_context()
+        logger.info(f"Loaded {len(prompts)} prompts from {self.prompts_dir}")
+
+    def _build_static_context(self):
+        base_context = self.prompts.get(CONSULTANT_PROMPT, DEFAULT_BASE_CONTEXT)
+        services_context = self.prompts.get(SERVICES_PROMPT)
+        if services_context:
+            return f"{base_context}\n\n{services_context}"
+        return base_context
+
+    def reload_if_changed(self):
+        mtimes = self._scan()
+        if mtimes != self.mtimes:
+            logger.info("Prompt files changed, reloading")
+            self.load(mtimes)
+            return True
+        return False
+
+    def get(self, name, default=None):
+        if self.static_context is None:
+            self.load()
+        return self.prompts.get(name, default)
+
+    def get_static_context(self):
+        if self.static_context is None:
+            self.load()
+        return self.static_context
+
+    async def watch(self, interval=PROMPT_RELOAD_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # Stat calls are cheap but still blocking, keep them off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.reload_if_changed)
+            except Exception as e:
+                logger.error(f"Error reloading prompts: {e}")
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+prompt_registry = PromptRegistry()
+
+async def start_prompt_registry():
+    if prompt_registry.static_context is None:
+        prompt_registry.load()
+    prompt_registry.task = asyncio.create_task(prompt_registry.watch())
+
+def get_prompt_registry():
+    return prompt_registry
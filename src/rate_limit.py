@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    Async token bucket: acquire() waits until a token is available.
+
+    The refill rate can be changed at runtime and the bucket can be blocked for a
+    while, e.g. when an API reports that its limit was hit. Waiters are served in order.
+    """
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.lock = None
+        self.waiting = 0
+        self.acquired = 0
+        self.total_wait_time = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        started = self.clock()
+        self.waiting += 1
+        try:
+            async with self.lock:
+                while True:
+                    now = self.clock()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        self.acquired += 1
+        self.total_wait_time += self.clock() - started
+
+    def set_rate(self, rate):
+        self._refill(self.clock())
+        self.rate = rate
+
+    def block_for(self, seconds):
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+    def get_metrics(self):
+        now = self.clock()
+        return {
+            "rate": round(self.rate, 2),
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "blocked_for": round(max(0.0, self.blocked_until - now), 1),
+            "avg_wait_ms": round(self.total_wait_time / self.acquired * 1000, 1) if self.acquired else 0.0
+        }
@@ -0,0 +1,36 @@
+import os
+import logging
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL") or os.getenv("REDIS_TLS_URL")
+
+_redis = None
+
+def get_redis():
+    """
+    Return the shared asyncio Redis client, creating it on first use.
+
+    :return: redis.asyncio.Redis instance, or None when REDIS_URL is not set
+    """
+    global _redis
+    if _redis is None and REDIS_URL:
+        import redis.asyncio as redis
+        options = {}
+        if REDIS_URL.startswith("rediss://"):
+            # Heroku Redis uses self-signed certificates
+            options["ssl_cert_reqs"] = None
+        _redis = redis.from_url(REDIS_URL, **options)
+        logger.info("Created shared Redis client")
+    return _redis
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        logger.info("Redis client closed")
+    _redis = None
@@ -1,76 +1,275 @@
 import asyncio
+import heapq
+import os
 import time
-from collections import defaultdict
+from datetime import datetime, timezone
 from instagram_api import send_message
-from ai_handler import generate_ai_response
-from database_handler import get_clients_for_reminders, get_client_data
+from ai_handler import generate_system_message
+from database_handler import get_due_reminders, get_next_reminder_time, count_due_reminders
+from write_buffer import get_write_buffer
+from rate_limit import TokenBucket
+from fanout import FanOut
+from reminder_variants import ReminderVariants
 import logging
 
 logger = logging.getLogger(__name__)
 
+REMINDER_PAGE_SIZE = int(os.getenv("REMINDER_PAGE_SIZE", 100))
+REMINDER_MAX_SLEEP = float(os.getenv("REMINDER_MAX_SLEEP", 3600))  # seconds; picks up reminders scheduled by other processes
+REMINDER_RETRY_DELAY = float(os.getenv("REMINDER_RETRY_DELAY", 3600))  # seconds before a failed reminder is retried
+
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", 10))
+REMINDER_SEND_WINDOW = float(os.getenv("REMINDER_SEND_WINDOW", 0))  # seconds to spread a run over, 0 sends as fast as the limits allow
+# Reminders get their own budgets so a large run can't starve live conversations
+REMINDER_ANTHROPIC_RATE = float(os.getenv("REMINDER_ANTHROPIC_RATE", 1))  # generations per second
+REMINDER_GRAPH_RATE = float(os.getenv("REMINDER_GRAPH_RATE", 2))  # sends per second
+
+REMINDER_DECISIONS = {"Uncertain", "Leaning Towards Yes", "Leaning Towards No"}
+
+def to_timestamp(value):
+    """
+    Parse a timestamptz returned by PostgREST into epoch seconds.
+    """
+    if not value:
+        return None
+    value = value.replace("Z", "+00:00").replace(" ", "T")
+    # Python 3.9 only parses 3 or 6 fraction digits, PostgREST drops trailing zeros
+    if "." in value:
+        head, tail = value.split(".", 1)
+        digits = len(tail) - len(tail.lstrip("0123456789"))
+        value = f"{head}.{tail[:digits].ljust(6, '0')[:6]}{tail[digits:]}"
+    return datetime.fromisoformat(value).timestamp()
+
+def to_iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+def needs_reminder(client):
+    # Same rule the old full-table scan filtered on
+    return client.get('final_decision') in REMINDER_DECISIONS or client.get('paid') is False
+
 class ReminderBot:
+    """
+    Sends follow-up reminders at the reminder_intervals after a client's last message.
+
+    The schedule lives in the clients table (next_reminder_at, reminder_stage), so it
+    survives restarts. A heap of known due times tells the bot when to wake up; when it
+    does, it only fetches the rows that are due, a page at a time.
+    """
     def __init__(self):
-        self.user_timestamps = defaultdict(float)
-        self.sent_reminders = defaultdict(set)
         self.reminder_intervals = [
             (12 * 3600, "12 hours"),
             (7 * 24 * 3600, "1 week"),
             (14 * 24 * 3600, "2 weeks"),
             (30 * 24 * 3600, "1 month")
         ]
+        self.due_times = []  # heap of (due time, instagram_id), entries replaced in scheduled are skipped
+        self.scheduled = {}  # instagram_id -> due time of its latest entry
+        self.next_db_due = None  # earliest due time in the database, which other processes may have scheduled
+        self.wake_event = None
         self.running = False
         self.task = None
+        self.anthropic_bucket = TokenBucket(REMINDER_ANTHROPIC_RATE)
+        self.graph_bucket = TokenBucket(REMINDER_GRAPH_RATE)
+        self.variants = ReminderVariants(self.anthropic_bucket)
+        self.current_run = None
+        self.last_run = None
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def _schedule(self, due_time, user_id):
+        if not self.running:
+            # Only the process that runs the bot keeps a schedule in memory
+            return
+        self.scheduled[user_id] = due_time
+        if len(self.due_times) > 2 * len(self.scheduled) + 100:
+            self.due_times = [(due, user) for user, due in self.scheduled.items()]
+            heapq.heapify(self.due_times)
+        heapq.heappush(self.due_times, (due_time, user_id))
+        # Wake the loop if this is now the earliest reminder
+        if self.due_times[0][0] == due_time:
+            self.wake_event.set()
+
+    def _pop_due(self, now):
+        while self.due_times and self.due_times[0][0] <= now:
+            due_time, user_id = heapq.heappop(self.due_times)
+            if self.scheduled.get(user_id) == due_time:
+                del self.scheduled[user_id]
 
     async def add_user_message(self, user_id):
-        self.user_timestamps[user_id] = time.time()
-        self.sent_reminders[user_id] = set()
+        # A new message restarts the reminder sequence from the first interval
+        now = time.time()
+        due_time = now + self.reminder_intervals[0][0]
+        get_write_buffer().add(user_id, {
+            'last_message_at': to_iso(now),
+            'next_reminder_at': to_iso(due_time),
+            'reminder_stage': 0
+        })
+        self._schedule(due_time, user_id)
 
-    async def check_and_send_reminders(self):
-        clients_for_reminders = await get_clients_for_reminders()
-        for client in clients_for_reminders:
-            await self.send_targeted_reminder(client)
+    def stage_label(self, client):
+        stage = min(client.get('reminder_stage') or 0, len(self.reminder_intervals) - 1)
+        return self.reminder_intervals[stage][1]
+
+    def _next_state(self, client, now):
+        """
+        :return: Tuple of (next stage, next due time or None when the sequence is over)
+        """
+        stage = (client.get('reminder_stage') or 0) + 1
+        if stage >= len(self.reminder_intervals):
+            return stage, None
+        last_message_at = to_timestamp(client.get('last_message_at')) or now
+        # After downtime, space the remaining reminders out instead of sending them back to back
+        gap = self.reminder_intervals[stage][0] - self.reminder_intervals[stage - 1][0]
+        return stage, max(last_message_at + self.reminder_intervals[stage][0], now + gap)
 
-    async def send_targeted_reminder(self, client):
+    async def process_reminder(self, client, now):
+        """
+        :return: False if the reminder was due but could not be sent
+        """
         user_id = client['instagram_id']
-        final_decision = client.get('final_decision', '')
-        payment_status = client.get('payment_status', False)
+        if not needs_reminder(client):
+            self.skipped += 1
+            get_write_buffer().add(user_id, {'next_reminder_at': None})
+            return True
+        if await self.send_targeted_reminder(client, self.stage_label(client)):
+            self.sent += 1
+            next_stage, next_due = self._next_state(client, now)
+            get_write_buffer().add(user_id, {
+                'reminder_stage': next_stage,
+                'next_reminder_at': to_iso(next_due) if next_due else None
+            })
+            return True
+        self.failed += 1
+        get_write_buffer().add(user_id, {'next_reminder_at': to_iso(now + REMINDER_RETRY_DELAY)})
+        return False
 
-        context = f"""You are an AI assistant for an Instagram consultant service. Your task is to generate a reminder message for a potential client. 
-        The client's final decision was "{final_decision}" and their payment status is {"completed" if payment_status else "pending"}. 
-        If the client hasn't made a decision, encourage them to make one. If they haven't paid, remind them about the payment.
-        The message should be engaging, encouraging, and aim to convert the lead or complete the payment. 
-        Keep the message concise, friendly, and tailored to the client's current status."""
+    async def check_and_send_reminders(self):
+        """
+        Send every reminder that is due, fetching due rows a page at a time and
+        processing each page concurrently.
 
-        input_text = f"Generate a targeted reminder message for a client with final decision: {final_decision} and payment status: {'completed' if payment_status else 'pending'}."
-        
+        :return: Number of clients processed
+        """
+        now = time.time()
+        due_before = to_iso(now)
+        total = await count_due_reminders(due_before)
+        if not total:
+            return 0
+        run = self.current_run = FanOut(REMINDER_CONCURRENCY, REMINDER_SEND_WINDOW, total, name="reminder run")
+        logger.info(f"Starting reminder run for {total} due reminders")
+        seen = set()
         try:
-            reminder_message = await generate_ai_response(user_id, input_text, context)
-        except Exception as e:
-            logger.error(f"Error generating AI reminder: {e}")
-            reminder_message = f"Hey there! We noticed you haven't made a final decision about our Instagram consultant service. We'd love to help you grow your Instagram presence. Let's chat about your needs!"
+            while True:
+                page = [client for client in await get_due_reminders(due_before, REMINDER_PAGE_SIZE)
+                        if client['instagram_id'] not in seen]
+                if not page:
+                    break
+                seen.update(client['instagram_id'] for client in page)
+                # In batch mode this generates the page's missing reminder variants in one job
+                await self.variants.prepare([(client, self.stage_label(client)) for client in page if needs_reminder(client)])
+                await run.run([lambda client=client: self.process_reminder(client, now) for client in page])
+                # Processed rows leave the due set once their new schedule is written; shielded
+                # so stopping the bot can't cut the write short after the buffer was taken
+                await asyncio.shield(get_write_buffer().flush())
+        finally:
+            self.current_run = None
+            self.last_run = run.get_metrics()
+        logger.info(f"Reminder run finished: {self.last_run}")
+        return len(seen)
+
+    async def send_targeted_reminder(self, client, interval_label):
+        user_id = client['instagram_id']
+        reminder_message = None
+        if self.variants.mode != "realtime":
+            reminder_message = await self.variants.get_message(client, interval_label)
+        if reminder_message is None:
+            reminder_message = await self.generate_personal_reminder(client, interval_label)
 
+        await self.graph_bucket.acquire()
         success = await send_message(user_id, reminder_message)
         if success:
-            logger.info(f"Sent targeted reminder to user {user_id}")
+            logger.info(f"Sent targeted reminder to user {user_id} ({interval_label} after their last message)")
         else:
             logger.error(f"Failed to send targeted reminder to user {user_id}")
+        return success
+
+    async def generate_personal_reminder(self, client, interval_label):
+        final_decision = client.get('final_decision', '')
+        paid = client.get('paid', False)
+
+        instructions = f"""Your task is to generate a reminder message for a potential client.
+        The client's final decision was "{final_decision}" and their payment status is {"completed" if paid else "pending"}.
+        If the client hasn't made a decision, encourage them to make one. If they haven't paid, remind them about the payment.
+        The message should be engaging, encouraging, and aim to convert the lead or complete the payment.
+        Keep the message concise, friendly, and tailored to the client's current status."""
+
+        input_text = f"Generate a targeted reminder message for a client with final decision: {final_decision} and payment status: {'completed' if paid else 'pending'}. Their last message was {interval_label} ago."
+
+        # System-initiated: kept out of the client's conversation history and profile
+        await self.anthropic_bucket.acquire()
+        reminder_message = await generate_system_message(input_text, instructions)
+        if reminder_message is None:
+            return f"Hey there! We noticed you haven't made a final decision about our Instagram consultant service. We'd love to help you grow your Instagram presence. Let's chat about your needs!"
+        return reminder_message
+
+    async def _sleep_until_due(self):
+        now = time.time()
+        self._pop_due(now)
+        next_due = await get_next_reminder_time(to_iso(now))
+        # Kept out of the heap, whose entries all carry an instagram_id
+        self.next_db_due = to_timestamp(next_due) if next_due else None
+        timeout = REMINDER_MAX_SLEEP
+        for due_time in (self.due_times[0][0] if self.due_times else None, self.next_db_due):
+            if due_time is not None:
+                timeout = min(timeout, max(0.0, due_time - now))
+        self.wake_event.clear()
+        try:
+            await asyncio.wait_for(self.wake_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
 
     async def run(self):
+        self.wake_event = asyncio.Event()
         self.running = True
         while self.running:
-            await self.check_and_send_reminders()
-            await asyncio.sleep(3600 * 12)  # Check every 12 hours
+            try:
+                await self.check_and_send_reminders()
+            except Exception as e:
+                logger.error(f"Error sending reminders: {e}")
+            try:
+                await self._sleep_until_due()
+            except Exception as e:
+                # One bad wake-up must not end the loop
+                logger.error(f"Error scheduling the next reminder run: {e}")
+                await asyncio.sleep(60)
 
-    def stop(self):
+    async def stop(self):
+        # Wait for the task to finish cancelling, so a run cut short can't add schedule
+        # updates to the write buffer after its final flush
         self.running = False
         if self.task:
             self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
         logger.info("ReminderBot stopped")
 
+    def get_metrics(self):
+        return {
+            "scheduled": len(self.scheduled),
+            "next_due_in": round(self.due_times[0][0] - time.time()) if self.due_times else None,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "variants": self.variants.get_metrics(),
+            "current_run": self.current_run.get_metrics() if self.current_run else None,
+            "last_run": self.last_run
+        }
+
 reminder_bot = ReminderBot()
 
 async def start_reminder_bot():
     reminder_bot.task = asyncio.create_task(reminder_bot.run())
 
 def get_reminder_bot():
-    return reminder_bot
\ No newline at end of file
+    return reminder_bot
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import re
+import time
+import zlib
+import logging
+from ai_handler import ANTHROPIC_HEADERS, CLAUDE_MODEL, build_system_request, generate_system_message
+from cache import TTLCache, MISSING
+from http_client import get_session, ANTHROPIC_TIMEOUT
+from utils import language_cache
+
+logger = logging.getLogger(__name__)
+
+REMINDER_GENERATION_MODE = os.getenv("REMINDER_GENERATION_MODE", "cache")  # realtime, cache or batch
+REMINDER_MODEL = os.getenv("REMINDER_MODEL", CLAUDE_MODEL)
+REMINDER_VARIANTS = int(os.getenv("REMINDER_VARIANTS", 3))  # messages generated per segment
+REMINDER_VARIANT_TTL = float(os.getenv("REMINDER_VARIANT_TTL", 24 * 3600))  # seconds
+REMINDER_BATCH_POLL_INTERVAL = float(os.getenv("REMINDER_BATCH_POLL_INTERVAL", 30))  # seconds
+REMINDER_BATCH_TIMEOUT = float(os.getenv("REMINDER_BATCH_TIMEOUT", 3600))  # seconds before falling back to real-time calls
+
+ANTHROPIC_BATCHES_URL = "https://api.anthropic.com/v1/messages/batches"
+ANTHROPIC_BATCH_HEADERS = dict(ANTHROPIC_HEADERS, **{"anthropic-beta": "prompt-caching-2024-07-31,message-batches-2024-09-24"})
+
+NAME_PLACEHOLDER = "{name}"
+NAME_PLACEHOLDER_WITH_SEPARATOR = re.compile(r"[ ,]*\{name\}")
+
+REMINDER_INSTRUCTIONS = """You are writing follow-up reminder messages that the Instagram consultant sends to potential clients in a direct message.
+The messages should be engaging, encouraging, and aim to convert the lead or complete the payment. If the client hasn't made a decision, encourage them to make one. If they haven't paid, remind them about the payment.
+Keep each message concise, friendly, and tailored to the client's current status."""
+
+def client_language(client):
+    return client.get('language') or language_cache.peek(client['instagram_id'], None) or 'english'
+
+def segment_key(client, stage_label):
+    """
+    Clients in one segment get the same reminder variants.
+
+    :return: Tuple of (final decision, paid, stage label, language)
+    """
+    return (client.get('final_decision') or "Unknown", client.get('paid'), stage_label, client_language(client))
+
+def build_variant_prompt(segment):
+    decision, paid, stage_label, language = segment
+    payment = {True: "has paid", False: "has not paid yet"}.get(paid, "has not said whether they paid")
+    return (
+        f"Write {REMINDER_VARIANTS} different reminder messages in {language} for a client whose decision about "
+        f"our service is \"{decision}\" and who {payment}. Their last message to us was {stage_label} ago.\n"
+        f"Start each message with a short greeting followed by the placeholder {NAME_PLACEHOLDER} for the client's "
+        f"first name, and don't use the name anywhere else.\n"
+        f"Reply with a JSON array of {REMINDER_VARIANTS} strings and nothing else."
+    )
+
+def build_variant_request(segment):
+    # The service description is the same cached prefix live conversations use
+    return build_system_request(build_variant_prompt(segment), REMINDER_INSTRUCTIONS, REMINDER_MODEL, 300 * REMINDER_VARIANTS)
+
+def parse_variants(text):
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return None
+    try:
+        variants = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    variants = [variant.strip() for variant in variants if isinstance(variant, str) and variant.strip()]
+    return variants or None
+
+def fill_variant(template, client):
+    name = (client.get('name') or "").strip()
+    if name:
+        return template.replace(NAME_PLACEHOLDER, name.split()[0])
+    return NAME_PLACEHOLDER_WITH_SEPARATOR.sub("", template)
+
+class ReminderVariants:
+    """
+    Reminder messages generated once per segment (decision, paid, stage, language)
+    and personalized locally, so a reminder run costs one generation per segment
+    instead of one per client. Variants come from real-time calls (cache mode) or
+    one Message Batches job per run (batch mode), and are cached for REMINDER_VARIANT_TTL.
+    """
+    def __init__(self, rate_limiter=None, mode=REMINDER_GENERATION_MODE):
+        self.mode = mode
+        self.rate_limiter = rate_limiter
+        self.cache = TTLCache(1000, REMINDER_VARIANT_TTL)
+        self.generating = {}  # segment -> task, so concurrent reminders of a segment share one call
+        self.generated_segments = 0
+        self.batch_jobs = 0
+        self.failed_segments = 0
+
+    async def get_message(self, client, stage_label):
+        """
+        :return: Personalized reminder text, or None if no variants could be generated
+        """
+        variants = await self.get_variants(segment_key(client, stage_label))
+        if not variants:
+            return None
+        # The same client always gets the same variant of a segment
+        template = variants[zlib.crc32(client['instagram_id'].encode('utf-8')) % len(variants)]
+        return fill_variant(template, client)
+
+    async def get_variants(self, segment):
+        variants = self.cache.get(segment)
+        if variants is not MISSING:
+            return variants
+        task = self.generating.get(segment)
+        if task is None:
+            task = self.generating[segment] = asyncio.create_task(self._generate(segment))
+            task.add_done_callback(lambda _: self.generating.pop(segment, None))
+        return await asyncio.shield(task)
+
+    async def _generate(self, segment):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        text = await generate_system_message(build_variant_prompt(segment), REMINDER_INSTRUCTIONS, REMINDER_MODEL, 300 * REMINDER_VARIANTS)
+        variants = parse_variants(text) if text else None
+        if variants:
+            self.generated_segments += 1
+            self.cache.put(segment, variants)
+        else:
+            logger.error(f"Could not generate reminder variants for {segment}")
+            self.failed_segments += 1
+        return variants
+
+    async def prepare(self, clients):
+        """
+        In batch mode, generate the variants of every uncached segment of the given
+        (client, stage label) pairs in one Message Batches job before they are sent.
+        """
+        if self.mode != "batch":
+            return
+        segments = list({segment_key(client, stage_label) for client, stage_label in clients
+                         if self.cache.peek(segment_key(client, stage_label)) is MISSING})
+        if not segments:
+            return
+        try:
+            results = await self._run_batch(segments)
+        except Exception as e:
+            logger.error(f"Reminder variant batch failed, falling back to real-time generation: {e}")
+            return
+        for segment, variants in zip(segments, results):
+            if variants:
+                self.generated_segments += 1
+                self.cache.put(segment, variants)
+
+    async def _run_batch(self, segments):
+        session = get_session()
+        requests = [{"custom_id": f"segment-{index}", "params": build_variant_request(segment)}
+                    for index, segment in enumerate(segments)]
+        async with session.post(ANTHROPIC_BATCHES_URL, headers=ANTHROPIC_BATCH_HEADERS, json={"requests": requests},
+                                timeout=ANTHROPIC_TIMEOUT) as response:
+            response.raise_for_status()
+            batch = await response.json()
+        self.batch_jobs += 1
+        logger.info(f"Submitted reminder variant batch {batch['id']} for {len(segments)} segments")
+
+        deadline = time.monotonic() + REMINDER_BATCH_TIMEOUT
+        while batch.get('processing_status') != "ended":
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"batch {batch['id']} not done after {REMINDER_BATCH_TIMEOUT}s")
+            await asyncio.sleep(REMINDER_BATCH_POLL_INTERVAL)
+            async with session.get(f"{ANTHROPIC_BATCHES_URL}/{batch['id']}", headers=ANTHROPIC_BATCH_HEADERS,
+                                   timeout=ANTHROPIC_TIMEOUT) as response:
+                response.raise_for_status()
+                batch = await response.json()
+
+        results = [None] * len(segments)
+        async with session.get(batch['results_url'], headers=ANTHROPIC_BATCH_HEADERS, timeout=ANTHROPIC_TIMEOUT) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                index = int(item['custom_id'].rsplit("-", 1)[1])
+                if item['result']['type'] == "succeeded":
+                    results[index] = parse_variants(item['result']['message']['content'][0]['text'])
+        logger.info(f"Reminder variant batch {batch['id']} done, {sum(bool(result) for result in results)}/{len(segments)} segments generated")
+        return results
+
+    def get_metrics(self):
+        return {
+            "mode": self.mode,
+            "cached_segments": len(self.cache),
+            "generated_segments": self.generated_segments,
+            "failed_segments": self.failed_segments,
+            "batch_jobs": self.batch_jobs
+        }
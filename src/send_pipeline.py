@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import random
+import logging
+import aiohttp
+from http_client import get_session, GRAPH_API_TIMEOUT
+from rate_limit import TokenBucket
+from dispatcher import KeyedDispatcher
+
+logger = logging.getLogger(__name__)
+
+GRAPH_SEND_RATE = float(os.getenv("GRAPH_SEND_RATE", 10))  # sends per second while usage is low
+GRAPH_SEND_MIN_RATE = float(os.getenv("GRAPH_SEND_MIN_RATE", 0.5))  # floor while usage is high
+GRAPH_SEND_MAX_RETRIES = int(os.getenv("GRAPH_SEND_MAX_RETRIES", 5))
+GRAPH_RETRY_BASE_DELAY = float(os.getenv("GRAPH_RETRY_BASE_DELAY", 1))  # seconds
+GRAPH_RETRY_MAX_DELAY = float(os.getenv("GRAPH_RETRY_MAX_DELAY", 60))  # seconds
+GRAPH_SEND_CONCURRENCY = int(os.getenv("GRAPH_SEND_CONCURRENCY", 20))
+GRAPH_USAGE_THROTTLE_START = 50  # usage percentage where sending starts to slow down
+
+# Graph API error codes for application, user and business use case rate limits
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, 80002, 80006}
+
+def parse_usage_headers(headers):
+    """
+    Read the Graph API usage headers.
+
+    :return: Tuple of (highest usage percentage, seconds until access is regained)
+    """
+    usage = 0.0
+    regain_seconds = 0.0
+    app_usage = headers.get('X-App-Usage')
+    if app_usage:
+        try:
+            usage = max([usage] + [float(value) for value in json.loads(app_usage).values()])
+        except (ValueError, TypeError, AttributeError):
+            logger.debug(f"Unparseable X-App-Usage header: {app_usage}")
+    business_usage = headers.get('X-Business-Use-Case-Usage')
+    if business_usage:
+        try:
+            for entries in json.loads(business_usage).values():
+                for entry in entries:
+                    usage = max(usage, *(float(entry.get(field, 0)) for field in ('call_count', 'total_cputime', 'total_time')))
+                    regain_seconds = max(regain_seconds, float(entry.get('estimated_time_to_regain_access', 0)) * 60)
+        except (ValueError, TypeError, AttributeError):
+            logger.debug(f"Unparseable X-Business-Use-Case-Usage header: {business_usage}")
+    return usage, regain_seconds
+
+def retry_delay(attempt, retry_after=None):
+    # Full jitter so retries from many senders don't line up
+    if retry_after:
+        return retry_after + random.uniform(0, GRAPH_RETRY_BASE_DELAY)
+    return random.uniform(0, min(GRAPH_RETRY_MAX_DELAY, GRAPH_RETRY_BASE_DELAY * 2 ** attempt))
+
+class GraphSendPipeline:
+    """
+    Outbound Graph API sends: one token bucket per account, throttled by the usage
+    headers Meta returns, retries with jittered exponential backoff for 5xx, 429 and
+    rate limit errors, and in-order delivery per recipient.
+    """
+    def __init__(self, rate=GRAPH_SEND_RATE, min_rate=GRAPH_SEND_MIN_RATE, max_retries=GRAPH_SEND_MAX_RETRIES):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_retries = max_retries
+        self.buckets = {}
+        self.usage = {}
+        self.dispatcher = KeyedDispatcher(GRAPH_SEND_CONCURRENCY, name="graph_send")
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def _bucket(self, account):
+        bucket = self.buckets.get(account)
+        if bucket is None:
+            bucket = self.buckets[account] = TokenBucket(self.rate)
+        return bucket
+
+    def _apply_usage(self, account, headers):
+        usage, regain_seconds = parse_usage_headers(headers)
+        self.usage[account] = usage
+        bucket = self._bucket(account)
+        if regain_seconds:
+            logger.warning(f"Graph API access for {account} is limited for {regain_seconds:.0f}s")
+            bucket.block_for(regain_seconds)
+        # Full rate up to the throttle threshold, then slow down linearly towards 100%
+        if usage <= GRAPH_USAGE_THROTTLE_START:
+            rate = self.rate
+        else:
+            share = max(0.0, (100 - usage) / (100 - GRAPH_USAGE_THROTTLE_START))
+            rate = max(self.min_rate, self.rate * share)
+        if rate != bucket.rate:
+            logger.info(f"Graph API usage for {account} at {usage:.0f}%, send rate now {rate:.2f}/s")
+            bucket.set_rate(rate)
+
+    async def post(self, url, account="me", **request_kwargs):
+        """
+        POST to the Graph API through the account's bucket, retrying transient failures.
+
+        :return: True if the request eventually succeeded
+        """
+        bucket = self._bucket(account)
+        session = get_session()
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            retry_after = None
+            try:
+                async with session.post(url, timeout=GRAPH_API_TIMEOUT, **request_kwargs) as response:
+                    body = await response.text()
+                    self._apply_usage(account, response.headers)
+                    if response.status < 400:
+                        self.sent += 1
+                        return True
+                    try:
+                        error = json.loads(body).get('error', {})
+                    except (ValueError, AttributeError):
+                        error = {}
+                    rate_limited = response.status == 429 or error.get('code') in RATE_LIMIT_ERROR_CODES
+                    if not (rate_limited or response.status >= 500 or error.get('is_transient')):
+                        self.failed += 1
+                        logger.error(f"Graph API request failed with status {response.status}: {body}")
+                        return False
+                    if response.headers.get('Retry-After', '').isdigit():
+                        retry_after = float(response.headers['Retry-After'])
+                    if rate_limited:
+                        # Hold back every send on this account, not just this one
+                        bucket.block_for(retry_delay(attempt, retry_after))
+                    logger.warning(f"Graph API request failed with status {response.status} "
+                                   f"(attempt {attempt + 1}/{self.max_retries + 1}): {body}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Graph API request error (attempt {attempt + 1}/{self.max_retries + 1}): {e!r}")
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(retry_delay(attempt, retry_after))
+        self.failed += 1
+        logger.error(f"Graph API request to {url} failed after {self.max_retries + 1} attempts")
+        return False
+
+    async def _post_in_order(self, recipient, url, requests, account):
+        for index, request_kwargs in enumerate(requests):
+            if not await self.post(url, account, **request_kwargs):
+                if index + 1 < len(requests):
+                    logger.error(f"Stopped sending to {recipient}: {len(requests) - index - 1} "
+                                 f"of {len(requests)} parts not delivered")
+                return False
+        return True
+
+    async def send(self, recipient, url, requests, account="me"):
+        """
+        Send several requests to one recipient in order, behind any earlier sends to it.
+
+        :param requests: List of keyword arguments for session.post, e.g. {'json': payload}
+        :return: True if all requests succeeded
+        """
+        return await self.dispatcher.submit(recipient, lambda: self._post_in_order(recipient, url, requests, account))
+
+    def get_metrics(self):
+        return {
+            "queue": self.dispatcher.get_metrics(),
+            "buckets": {account: bucket.get_metrics() for account, bucket in self.buckets.items()},
+            "usage": dict(self.usage),
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed
+        }
+
+graph_send_pipeline = GraphSendPipeline()
+
+def get_send_pipeline():
+    return graph_send_pipeline
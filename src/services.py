@@ -0,0 +1,58 @@
+import logging
+from http_client import start_http_client, close_http_client
+from prompt_registry import start_prompt_registry, get_prompt_registry
+from write_buffer import start_write_buffer, get_write_buffer
+from reminder_bot import get_reminder_bot
+from message_handler import process_pending_batches, event_dispatcher, reply_dispatcher
+from event_queue import get_event_queue
+from database_handler import shutdown_db_executor, get_cache_metrics
+from utils import conversation_history, client_profiles
+from dedup import get_dedup_index
+from redis_client import close_redis
+from send_pipeline import get_send_pipeline
+
+logger = logging.getLogger(__name__)
+
+async def start_services():
+    """
+    Start the shared services every process that handles events needs.
+    """
+    # Open the shared HTTP connection pool used by all outbound API calls
+    await start_http_client()
+
+    # Load prompts into memory and watch them for changes
+    await start_prompt_registry()
+
+    # Start the write-behind buffer for client profile updates
+    await start_write_buffer()
+
+async def stop_services():
+    """
+    Finish pending work and release the services started by start_services.
+    Stop the event queue first so no new events come in.
+    """
+    logger.info("Processing pending message batches...")
+    batch_count = await process_pending_batches()
+    logger.info(f"Processed {batch_count} pending batches")
+    # The reminder bot writes schedule updates to the write buffer, so it stops first
+    logger.info("Stopping reminder bot...")
+    reminder_bot = get_reminder_bot()
+    if reminder_bot:
+        await reminder_bot.stop()
+    logger.info("Flushing client write buffer...")
+    await get_write_buffer().stop()
+    get_prompt_registry().stop()
+    logger.info("Closing conversation history store...")
+    await conversation_history.close()
+    await close_redis()
+    logger.info("Closing HTTP client...")
+    await close_http_client()
+    shutdown_db_executor()
+
+def format_metrics():
+    return (f"event queue: {get_event_queue().get_metrics()}, dispatcher: {event_dispatcher.get_metrics()}, "
+            f"replies: {reply_dispatcher.get_metrics()}, "
+            f"write buffer: {get_write_buffer().get_metrics()}, client cache: {get_cache_metrics()}, "
+            f"profiles: {client_profiles.get_metrics()}, "
+            f"dedup: {get_dedup_index().get_metrics()}, graph send: {get_send_pipeline().get_metrics()}, "
+            f"reminders: {get_reminder_bot().get_metrics()}")
@@ -1,6 +1,7 @@
 import asyncio
-from ai_handler import generate_ai_response, extract_client_info
-from database_handler import save_or_update_client_data, get_client_data
+from ai_handler import generate_ai_response, record_client_message
+from database_handler import get_client_data
+from write_buffer import get_write_buffer
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -24,23 +25,22 @@ async def simulate_conversation():
         # User message
         logger.info(f"User: {message}")
         
+        # Extract and update client info
+        new_info = await record_client_message(user_id, message)
+        if new_info:
+            logger.info(f"Updated client info: {new_info}")
+
         # AI response
         ai_response = await generate_ai_response(user_id, message)
         logger.info(f"AI: {ai_response}")
 
-        # Extract and update client info
-        new_info = extract_client_info(message)
-        if new_info:
-            try:
-                await save_or_update_client_data(user_id, new_info)
-                logger.info(f"Updated client info: {new_info}")
-            except Exception as e:
-                logger.error(f"Error updating client info: {str(e)}")
-
         # Check if AI provides a summary when all information is collected
         if "summary" in ai_response.lower():
             logger.info("AI provided a summary of collected information.")
 
+    # Write buffered client updates before reading them back
+    await get_write_buffer().flush()
+
     # Verify saved data
     try:
         saved_data = await get_client_data(user_id)
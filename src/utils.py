@@ -1,50 +1,380 @@
-from collections import deque, defaultdict
+from collections import OrderedDict
+import asyncio
+import hashlib
 import logging
-from langdetect import detect, LangDetectException
+import os
+import re
+import time
+from cache import TTLCache, MISSING
+from history_store import create_history_backend
+from dedup import get_dedup_index
 
 logger = logging.getLogger(__name__)
 
-MAX_HISTORY_LENGTH = 10
+MAX_HISTORY_LENGTH = 50  # hard cap on stored messages; the token budget decides what is sent
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 2000))
+HISTORY_IDLE_TTL = float(os.getenv("HISTORY_IDLE_TTL", 3600))  # seconds before an idle user is dropped from memory
+HISTORY_MAX_LOADED_USERS = int(os.getenv("HISTORY_MAX_LOADED_USERS", 1000))
+CLIENT_PROFILE_MAX_SIZE = int(os.getenv("CLIENT_PROFILE_MAX_SIZE", HISTORY_MAX_LOADED_USERS))
+CLIENT_PROFILE_TTL = float(os.getenv("CLIENT_PROFILE_TTL", HISTORY_IDLE_TTL))  # seconds before a profile is reloaded
+MAX_PENDING_MESSAGES = MAX_HISTORY_LENGTH  # cap on messages waiting to be summarized, e.g. while the summarizer fails
+
+def estimate_tokens(text):
+    # About 4 bytes of UTF-8 per token; Cyrillic takes 2 bytes a letter, so it counts double
+    return len(text.encode('utf-8')) // 4 + 1
 
 class ConversationHistory:
-    def __init__(self):
-        self.history = defaultdict(lambda: deque(maxlen=MAX_HISTORY_LENGTH))
+    """
+    Conversation history per user, persisted in a pluggable backend (memory, SQLite or Redis).
+
+    Histories are loaded lazily on first access and kept in a bounded working set;
+    users idle for HISTORY_IDLE_TTL seconds, or beyond HISTORY_MAX_LOADED_USERS, are
+    dropped from memory and reloaded from the backend when they write again.
+
+    Stored messages that no longer fit the token budget slide into a pending list,
+    which a background task folds into a rolling summary using the summarizer set
+    with set_summarizer. Pending messages stay part of the context until they are
+    folded, so nothing is hidden from the model while the summary catches up.
+    """
+    def __init__(self, backend=None, idle_ttl=HISTORY_IDLE_TTL, max_loaded_users=HISTORY_MAX_LOADED_USERS,
+                 token_budget=HISTORY_TOKEN_BUDGET):
+        self.backend = backend
+        self.token_budget = token_budget
+        self.idle_ttl = idle_ttl
+        self.max_loaded_users = max_loaded_users
+        self.loaded = OrderedDict()  # user_id -> (record, last access time)
+        self.summarizer = None
+        self.folding = {}  # user_id -> running summary task
+
+    def _get_backend(self):
+        if self.backend is None:
+            self.backend = create_history_backend()
+        return self.backend
+
+    def set_summarizer(self, summarizer):
+        """
+        :param summarizer: async function (previous_summary, messages) -> new summary, or None on failure
+        """
+        self.summarizer = summarizer
+
+    def _evict_idle(self, now):
+        while self.loaded:
+            user_id, (_, last_access) = next(iter(self.loaded.items()))
+            if len(self.loaded) <= self.max_loaded_users and now - last_access < self.idle_ttl:
+                break
+            del self.loaded[user_id]
+            logger.debug(f"Evicted idle conversation history for user {user_id}")
+
+    async def _load(self, user_id):
+        now = time.monotonic()
+        entry = self.loaded.get(user_id)
+        if entry is None:
+            try:
+                stored = await self._get_backend().load(user_id)
+            except Exception as e:
+                logger.error(f"Error loading conversation history for user {user_id}: {e}")
+                stored = None
+            # Another task may have loaded the same user while we were waiting
+            entry = self.loaded.get(user_id)
+            if entry is None:
+                record = {"messages": [], "summary": "", "pending": []}
+                if stored:
+                    record.update(stored)
+                entry = (record, now)
+        self.loaded[user_id] = (entry[0], now)
+        self.loaded.move_to_end(user_id)
+        self._evict_idle(now)
+        return entry[0]
+
+    async def _save(self, user_id, record):
+        try:
+            await self._get_backend().save(user_id, record)
+        except Exception as e:
+            logger.error(f"Error saving conversation history for user {user_id}: {e}")
+
+    @staticmethod
+    def _window_start(messages, token_budget):
+        """
+        Index of the first of the newest messages that fit the token budget.
+        """
+        remaining = token_budget
+        keep_from = len(messages)
+        while keep_from > 0:
+            cost = estimate_tokens(messages[keep_from - 1]["content"])
+            if cost > remaining:
+                break
+            remaining -= cost
+            keep_from -= 1
+        # Windows must start with a user message
+        while keep_from < len(messages) and messages[keep_from]["role"] != "user":
+            keep_from += 1
+        return keep_from
 
-    def add_message(self, user_id, role, content):
-        self.history[user_id].append({"role": role, "content": content})
-        logger.debug(f"Added message for user {user_id}: {role} - {content[:50]}...")
+    def _slide(self, user_id, record, keep_from):
+        messages = record["messages"]
+        if keep_from == 0:
+            return False
+        pending = record["pending"]
+        pending.extend(messages[:keep_from])
+        del messages[:keep_from]
+        logger.debug(f"Slid {keep_from} messages out of the window for user {user_id}")
+        # A running fold removes the messages it summarized by count, so only trim between folds
+        if len(pending) > MAX_PENDING_MESSAGES and user_id not in self.folding:
+            dropped = len(pending) - MAX_PENDING_MESSAGES
+            del pending[:dropped]
+            logger.warning(f"Dropped {dropped} unsummarized messages for user {user_id}")
+        return True
+
+    def _schedule_fold(self, user_id):
+        if user_id not in self.folding:
+            self.folding[user_id] = asyncio.create_task(self._fold(user_id))
+
+    async def _fold(self, user_id):
+        try:
+            while True:
+                record = await self._load(user_id)
+                pending = list(record["pending"])
+                if not pending:
+                    return
+                if self.summarizer is None:
+                    summary = record["summary"]
+                else:
+                    summary = await self.summarizer(record["summary"], pending)
+                    if not summary:
+                        # Keep the messages pending (and in the context) and retry on the next message
+                        return
+                # Reload in case the record was evicted and reloaded while summarizing
+                record = await self._load(user_id)
+                if summary:
+                    record["summary"] = summary
+                del record["pending"][:len(pending)]
+                await self._save(user_id, record)
+                logger.debug(f"Folded {len(pending)} messages into the summary for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error summarizing conversation history for user {user_id}: {e}")
+        finally:
+            self.folding.pop(user_id, None)
+
+    async def add_message(self, user_id, role, content):
+        await self.add_messages(user_id, [(role, content)])
+
+    async def add_messages(self, user_id, new_messages):
+        """
+        Append several (role, content) messages and persist them with one write.
+        """
+        record = await self._load(user_id)
+        for role, content in new_messages:
+            record["messages"].append({"role": role, "content": content})
+            logger.debug(f"Added message for user {user_id}: {role} - {content[:50]}...")
+        # The stored window follows the budget alone, never the size of one request
+        messages = record["messages"]
+        keep_from = max(len(messages) - MAX_HISTORY_LENGTH, self._window_start(messages, self.token_budget))
+        self._slide(user_id, record, keep_from)
+        await self._save(user_id, record)
+        if record["pending"]:
+            self._schedule_fold(user_id)
 
-    def get_history(self, user_id):
+    async def get_history(self, user_id):
         logger.debug(f"Retrieving conversation history for user {user_id}")
-        return list(self.history[user_id])
+        return list((await self._load(user_id))["messages"])
 
-    def clear_history(self, user_id):
-        self.history[user_id].clear()
+    async def get_context(self, user_id, token_budget=None, reserved_tokens=0):
+        """
+        Return the newest messages that fit the token budget plus the rolling summary of older ones.
+        The window is computed per call; the stored history is left unchanged.
+
+        :param token_budget: Token budget for the history messages, defaults to the history's budget
+        :param reserved_tokens: Part of the budget already taken, e.g. by the new user message
+        :return: Tuple of (summary, list of messages)
+        """
+        record = await self._load(user_id)
+        # Messages not folded yet come right after the summary and before the stored window
+        messages = record["pending"] + record["messages"]
+        if token_budget is None:
+            token_budget = self.token_budget
+        keep_from = self._window_start(messages, token_budget - reserved_tokens)
+        return record["summary"], messages[keep_from:]
+
+    async def clear_history(self, user_id):
+        self.loaded.pop(user_id, None)
+        await self._get_backend().delete(user_id)
         logger.debug(f"Cleared conversation history for user {user_id}")
 
+    async def close(self):
+        if self.folding:
+            await asyncio.gather(*self.folding.values(), return_exceptions=True)
+        if self.backend is not None:
+            await self.backend.close()
+
 conversation_history = ConversationHistory()
 
-def is_duplicate_message(message_queue, sender_id, message_text, timestamp):
-    message_id = f"{sender_id}:{message_text}:{timestamp}"
-    if message_id in message_queue:
-        logger.debug(f"Duplicate message detected: {message_id}")
+class ClientProfile:
+    """
+    Client information collected so far, updated once per new user message.
+    """
+    def __init__(self):
+        self.fields = {}
+        self.summary = None  # cached info summary, reset whenever a field changes
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def get(self, field, default=None):
+        return self.fields.get(field, default)
+
+    def update(self, new_info):
+        """
+        Merge newly extracted fields into the profile.
+
+        :param new_info: Fields extracted from one message
+        :return: Dictionary of the fields whose value actually changed
+        """
+        changed = {field: value for field, value in new_info.items() if self.fields.get(field) != value}
+        if changed:
+            self.fields.update(changed)
+            self.summary = None
+        return changed
+
+class ClientProfiles:
+    """
+    Profiles of recently active users in a bounded cache. A profile is loaded with the
+    loader set with set_loader on first access, so what a client told us before a
+    restart or eviction isn't asked for again.
+    """
+    def __init__(self, max_size=CLIENT_PROFILE_MAX_SIZE, ttl=CLIENT_PROFILE_TTL):
+        self.profiles = TTLCache(max_size, ttl)
+        self.loader = None
+        self.loading = {}  # user_id -> load task, so concurrent first accesses share one read
+
+    def set_loader(self, loader):
+        """
+        :param loader: async function (user_id) -> dictionary of stored profile fields, or None
+        """
+        self.loader = loader
+
+    async def get_profile(self, user_id):
+        profile = self.profiles.get(user_id)
+        if profile is not MISSING:
+            return profile
+        task = self.loading.get(user_id)
+        if task is None:
+            task = self.loading[user_id] = asyncio.create_task(self._load(user_id))
+            task.add_done_callback(lambda _: self.loading.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id):
+        profile = ClientProfile()
+        if self.loader is not None:
+            try:
+                fields = await self.loader(user_id)
+            except Exception as e:
+                logger.error(f"Error loading client profile for user {user_id}: {e}")
+                fields = None
+            if fields:
+                profile.fields.update(fields)
+        self.profiles.put(user_id, profile)
+        return profile
+
+    def clear_profile(self, user_id):
+        self.profiles.invalidate(user_id)
+        logger.debug(f"Cleared client profile for user {user_id}")
+
+    def get_metrics(self):
+        return self.profiles.get_metrics()
+
+client_profiles = ClientProfiles()
+
+def message_dedup_key(sender_id, message, timestamp):
+    # Meta's message id identifies redeliveries; hash the content for events without one
+    mid = message.get('mid')
+    if mid:
+        return mid
+    content = f"{sender_id}:{timestamp}:{message.get('text', '')}".encode('utf-8')
+    return "h:" + hashlib.blake2b(content, digest_size=16).hexdigest()
+
+async def is_duplicate_message(sender_id, message, timestamp):
+    """
+    Check a message against the dedup index and record it.
+
+    :param message: The 'message' object of a messaging event
+    :return: True if the same message was already handled within DEDUP_TTL
+    """
+    key = message_dedup_key(sender_id, message, timestamp)
+    if await get_dedup_index().check_and_add(key):
+        logger.debug(f"Duplicate message detected: {key}")
         return True
-    message_queue.append(message_id)
-    logger.debug(f"New message added to queue: {message_id}")
     return False
 
-def detect_language(text):
+# Letters only the Kazakh Cyrillic alphabet has
+KAZAKH_LETTERS = re.compile(r"[әғқңөұүһіӘҒҚҢӨҰҮҺІ]")
+CYRILLIC_LETTERS = re.compile(r"[а-яёА-ЯЁ]")
+LATIN_LETTERS = re.compile(r"[a-zA-Z]")
+NON_LANGUAGE_TOKENS = re.compile(r"\S+@\S+|@\w+|https?://\S+|www\.\S+")
+# Common Kazakh words that are often typed without the Kazakh-specific letters
+KAZAKH_WORDS = re.compile(r"\b(?:рахмет|салем|салеметсиз|калайсыз|жаксы|иа)\b", re.IGNORECASE)
+LANGUAGE_SWITCH_MIN_LETTERS = int(os.getenv("LANGUAGE_SWITCH_MIN_LETTERS", 12))  # letters needed to change a user's language
+LANGUAGE_CACHE_MAX_SIZE = int(os.getenv("LANGUAGE_CACHE_MAX_SIZE", 10000))
+LANGUAGE_CACHE_TTL = float(os.getenv("LANGUAGE_CACHE_TTL", 7 * 24 * 3600))
+
+language_cache = TTLCache(LANGUAGE_CACHE_MAX_SIZE, LANGUAGE_CACHE_TTL)
+_langdetect = None
+
+def _detect_with_model(text):
+    # langdetect loads its profiles on first use, so import it only when a message needs it
+    global _langdetect
+    if _langdetect is None:
+        import langdetect
+        langdetect.DetectorFactory.seed = 0  # make results deterministic
+        _langdetect = langdetect
     try:
-        lang = detect(text)
-        if lang == 'ru':
-            logger.debug("Detected language: Russian")
-            return 'russian'
-        elif lang == 'kk':
-            logger.debug("Detected language: Kazakh")
-            return 'kazakh'
-        else:
-            logger.debug(f"Detected language: {lang}")
-            return 'english'  # Default to English for other languages
-    except LangDetectException:
+        lang = _langdetect.detect(text)
+    except _langdetect.LangDetectException:
         logger.warning("Language detection failed, defaulting to English")
-        return 'english'
\ No newline at end of file
+        return 'english'
+    return {'ru': 'russian', 'kk': 'kazakh'}.get(lang, 'english')
+
+def classify_language(text):
+    """
+    Guess the language of a message from its alphabet.
+
+    :return: Tuple of (language, number of letters seen); language is None when the
+             text has no letters or mixes both alphabets too evenly to tell
+    """
+    # E-mails, handles and links are Latin whatever language the message is in
+    text = NON_LANGUAGE_TOKENS.sub(" ", text)
+    cyrillic = len(CYRILLIC_LETTERS.findall(text))
+    kazakh = len(KAZAKH_LETTERS.findall(text))
+    latin = len(LATIN_LETTERS.findall(text))
+    letters = cyrillic + kazakh + latin
+    if not letters:
+        return None, 0
+    if kazakh or (cyrillic > latin and KAZAKH_WORDS.search(text)):
+        return 'kazakh', letters
+    # A few words in the other alphabet are common (brand names), only a close mix is ambiguous
+    if cyrillic >= 2 * latin:
+        return 'russian', letters
+    if latin >= 2 * cyrillic:
+        return 'english', letters
+    return None, letters
+
+def detect_language(text, user_id=None):
+    """
+    Detect whether a message is Russian, Kazakh or English.
+
+    With a user_id the language is sticky: messages without letters, too short to be
+    sure (emoji, "ok", a phone number) or mixing alphabets keep the user's last language.
+    The langdetect model is only used for mixed messages from users seen for the first time.
+
+    :return: 'russian', 'kazakh' or 'english'
+    """
+    language, letters = classify_language(text)
+    cached = language_cache.get(user_id, None) if user_id is not None else None
+    if cached is not None and (language is None or letters < LANGUAGE_SWITCH_MIN_LETTERS):
+        return cached
+    if language is None:
+        # Only a mix of alphabets from a user we know nothing about needs the full model
+        language = _detect_with_model(text) if letters else 'english'
+    if user_id is not None and language != cached:
+        language_cache.put(user_id, language)
+        logger.debug(f"Detected language for user {user_id}: {language}")
+    return language
@@ -1,6 +1,6 @@
 from aiohttp import web
 import json
-from message_handler import handle_instagram_event
+from event_queue import get_event_queue
 import os
 import logging
 import traceback
@@ -24,21 +24,15 @@ async def handle_instagram_webhook(request):
     elif request.method == 'POST':
         try:
             body = await request.json()
-            logger.info("Received webhook data:")
-            logger.info(json.dumps(body, indent=2))
+            logger.info("Received webhook data")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(json.dumps(body, indent=2))
             
-            # Handle Instagram-specific events
+            # Handle Instagram-specific events in the background so Meta gets an immediate ack
             if 'object' in body and body['object'] == 'instagram':
-                logger.debug(f"Full Instagram event data: {json.dumps(body, indent=2)}")
-                for entry in body.get('entry', []):
-                    if 'messaging' in entry:
-                        for messaging_event in entry['messaging']:
-                            logger.debug(f"Individual messaging event: {json.dumps(messaging_event, indent=2)}")
-                    elif 'changes' in entry:
-                        for change in entry.get('changes', []):
-                            logger.debug(f"Individual change event: {json.dumps(change, indent=2)}")
-                
-                await handle_instagram_event(body)
+                if not get_event_queue().enqueue(body):
+                    # Let Meta redeliver later instead of losing the event
+                    return web.Response(status=503)
             else:
                 logger.warning(f"Received unknown webhook object: {body.get('object')}")
             
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import zlib
+from event_queue import get_event_queue, EVENT_QUEUE_MAXSIZE
+from reminder_bot import start_reminder_bot
+from services import start_services, stop_services, format_metrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 1))
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", 20))  # seconds a worker gets to drain on shutdown
+WORKER_METRICS_INTERVAL = 60  # seconds
+
+def split_event(body):
+    """
+    Split a webhook payload into single-event payloads with their routing key.
+
+    Messaging events are keyed by sender and mentions by comment, the same keys
+    the event dispatcher serializes on.
+
+    :return: List of (key, payload) tuples in webhook order
+    """
+    events = []
+    for entry in body.get('entry', []):
+        header = {field: value for field, value in entry.items() if field not in ('messaging', 'changes')}
+        if 'messaging' in entry:
+            for messaging_event in entry['messaging']:
+                key = messaging_event.get('sender', {}).get('id')
+                events.append((key, {'object': body.get('object'), 'entry': [dict(header, messaging=[messaging_event])]}))
+        elif 'changes' in entry:
+            for change in entry.get('changes', []):
+                key = change.get('value', {}).get('comment_id')
+                events.append((key, {'object': body.get('object'), 'entry': [dict(header, changes=[change])]}))
+    return events
+
+def worker_index(key, worker_count):
+    # crc32 rather than hash(), which is randomized per process
+    return zlib.crc32(str(key).encode('utf-8')) % worker_count
+
+class WorkerPool:
+    """
+    Runs event handling in several processes behind one webhook endpoint.
+
+    Every sender is always routed to the same worker, so batching, conversation
+    history and the per-sender ordering of the event dispatcher stay in one process.
+    Worker 0 also runs the reminder bot.
+    """
+    def __init__(self, processes=WORKER_PROCESSES, maxsize=EVENT_QUEUE_MAXSIZE):
+        self.process_count = processes
+        self.maxsize = maxsize
+        self.context = multiprocessing.get_context("spawn")
+        self.queues = []
+        self.processes = []
+        self.routed = [0] * processes
+        self.restarts = 0
+
+    def _spawn(self, index):
+        process = self.context.Process(
+            target=run_worker, args=(index, self.queues[index], index == 0), name=f"event-worker-{index}"
+        )
+        process.start()
+        logger.info(f"Started event worker {index} (pid {process.pid})")
+        return process
+
+    def start(self):
+        self.queues = [self.context.Queue(maxsize=self.maxsize) for _ in range(self.process_count)]
+        self.processes = [self._spawn(index) for index in range(self.process_count)]
+
+    async def route(self, body):
+        """
+        Event queue handler of the front process: hand each event to its sender's worker.
+        """
+        for key, event in split_event(body):
+            index = worker_index(key, self.process_count)
+            while True:
+                try:
+                    self.queues[index].put_nowait(event)
+                    break
+                except queue.Full:
+                    # Worker is behind; wait instead of dropping so its events stay in order
+                    await asyncio.sleep(0.05)
+            self.routed[index] += 1
+
+    def check_workers(self):
+        # Replace crashed workers; their queue, and the events waiting in it, are kept
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                logger.error(f"Event worker {index} exited with code {process.exitcode}, restarting")
+                self.restarts += 1
+                self.processes[index] = self._spawn(index)
+
+    def stop(self, timeout=WORKER_STOP_TIMEOUT):
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        for index, process in enumerate(self.processes):
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Event worker {index} did not stop within {timeout}s, killing it")
+                process.kill()
+                process.join()
+        logger.info("Event workers stopped")
+
+    def get_metrics(self):
+        return {
+            "workers": self.process_count,
+            "alive": sum(process.is_alive() for process in self.processes),
+            "routed": list(self.routed),
+            "restarts": self.restarts
+        }
+
+async def log_worker_metrics(index):
+    while True:
+        await asyncio.sleep(WORKER_METRICS_INTERVAL)
+        logger.info(f"Event worker {index} is running... {format_metrics()}")
+
+async def worker_main(index, event_source, run_reminders):
+    await start_services()
+    if run_reminders:
+        await start_reminder_bot()
+    event_queue = get_event_queue()
+    event_queue.start()
+    loop = asyncio.get_running_loop()
+    metrics_task = asyncio.create_task(log_worker_metrics(index))
+    try:
+        while True:
+            event = await loop.run_in_executor(None, event_source.get)
+            if event is None:
+                break
+            await event_queue.put(event)
+    finally:
+        metrics_task.cancel()
+        await event_queue.stop()
+        await stop_services()
+        logger.info(f"Event worker {index} stopped")
+
+def run_worker(index, event_source, run_reminders):
+    # Ctrl+C and the platform's SIGTERM reach every process at once; shutdown is coordinated
+    # by the front process, which sends the stop marker only after routing its last events
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.DEBUG if not os.getenv('DYNO') else logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(worker_main(index, event_source, run_reminders))
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import logging
+from collections import defaultdict
+from database_handler import bulk_upsert_client_data, update_cached_client
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_MAX_USERS = int(os.getenv("WRITE_BUFFER_MAX_USERS", 100))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.getenv("WRITE_BUFFER_FLUSH_INTERVAL", 2))  # seconds
+
+class ClientWriteBuffer:
+    """
+    Write-behind buffer for client profile updates.
+
+    Field updates are merged per user in memory and written as bulk upserts when
+    WRITE_BUFFER_MAX_USERS users are pending or every WRITE_BUFFER_FLUSH_INTERVAL
+    seconds, so database writes scale with active users rather than messages.
+    """
+    def __init__(self, max_users=WRITE_BUFFER_MAX_USERS, flush_interval=WRITE_BUFFER_FLUSH_INTERVAL):
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.flush_event = None
+        self.flush_lock = None
+        self.task = None
+        self.running = False
+        self.updates = 0
+        self.coalesced = 0
+        self.flushed_rows = 0
+        self.flush_requests = 0
+        self.failed_rows = 0
+
+    def add(self, instagram_id, fields):
+        if not fields:
+            return
+        self.updates += 1
+        if instagram_id in self.pending:
+            self.coalesced += 1
+            self.pending[instagram_id].update(fields)
+        else:
+            self.pending[instagram_id] = dict(fields)
+        # Reads see buffered fields right away, before they reach the database
+        update_cached_client(instagram_id, fields)
+        if len(self.pending) >= self.max_users and self.flush_event is not None:
+            self.flush_event.set()
+
+    def get_pending(self, instagram_id):
+        return self.pending.get(instagram_id)
+
+    async def flush(self):
+        """
+        Write all pending updates to the database.
+
+        :return: Number of rows written
+        """
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            if not self.pending:
+                return 0
+            pending, self.pending = self.pending, {}
+
+            # PostgREST takes the columns of a bulk upsert from its rows, so rows
+            # with different field sets go in separate requests to avoid nulling columns
+            groups = defaultdict(list)
+            for instagram_id, fields in pending.items():
+                row = dict(fields, instagram_id=instagram_id)
+                groups[tuple(sorted(row))].append(row)
+
+            written = 0
+            for rows in groups.values():
+                self.flush_requests += 1
+                if await bulk_upsert_client_data(rows):
+                    written += len(rows)
+                else:
+                    self.failed_rows += len(rows)
+                    self._requeue(rows)
+            self.flushed_rows += written
+            logger.debug(f"Flushed {written} client rows in {len(groups)} requests")
+            return written
+
+    def _requeue(self, rows):
+        # Keep failed rows for the next flush; newer pending values win
+        for row in rows:
+            instagram_id = row.pop('instagram_id')
+            row.update(self.pending.get(instagram_id, {}))
+            self.pending[instagram_id] = row
+
+    async def run(self):
+        self.flush_event = asyncio.Event()
+        self.running = True
+        while self.running:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing client write buffer: {e}")
+
+    async def stop(self):
+        # Let the flush loop finish its current write instead of cancelling it mid-request
+        self.running = False
+        if self.task:
+            if self.flush_event is not None:
+                self.flush_event.set()
+            await self.task
+            self.task = None
+        written = await self.flush()
+        logger.info(f"Client write buffer stopped, flushed {written} rows on shutdown")
+
+    def get_metrics(self):
+        return {
+            "pending_users": len(self.pending),
+            "updates": self.updates,
+            "coalesced": self.coalesced,
+            "flushed_rows": self.flushed_rows,
+            "flush_requests": self.flush_requests,
+            "failed_rows": self.failed_rows
+        }
+
+client_write_buffer = ClientWriteBuffer()
+
+async def start_write_buffer():
+    client_write_buffer.task = asyncio.create_task(client_write_buffer.run())
+
+def get_write_buffer():
+    return client_write_buffer